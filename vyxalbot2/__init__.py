@@ -16,7 +16,9 @@ from vyxalbot2.github import GitHubApplication
 from vyxalbot2.reactions import Reactions
 from vyxalbot2.services.discord import DiscordService
 from vyxalbot2.services.se import SEService
-from vyxalbot2.userdb import UserDB
+from vyxalbot2.userdb import UserDB, UserStore
+from vyxalbot2.userdb.mongo import MongoUserStore
+from vyxalbot2.userdb.sqlite import SQLiteUserStore
 from vyxalbot2.types import (
     CommonData,
     PublicConfigType,
@@ -46,11 +48,21 @@ class VyxalBot2:
         with open(privateConfig["pem"], "r") as f:
             self.privkey = f.read()
 
+    def createUserStore(self) -> UserStore:
+        match self.privateConfig.get("userStore", "mongo"):
+            case "mongo":
+                return MongoUserStore(
+                    AsyncIOMotorClient(self.privateConfig["mongoUrl"]),
+                    self.privateConfig["database"],
+                )
+            case "sqlite":
+                return SQLiteUserStore(self.privateConfig.get("sqlitePath", "users.db"))
+            case other:
+                raise ValueError(f"Unknown user store {other}")
+
     async def run(self):
-        userDB = UserDB(
-            AsyncIOMotorClient(self.privateConfig["mongoUrl"]),
-            self.privateConfig["database"],
-        )
+        self.userDB = UserDB(self.createUserStore())
+        await self.userDB.setup()
 
         ghApp = GitHubApplication(
             self.publicConfig,
@@ -58,6 +70,7 @@ class VyxalBot2:
             self.privateConfig["appID"],
             self.privateConfig["account"],
             self.privateConfig["webhookSecret"],
+            self.privateConfig.get("deliveryQueuePath", "deliveries.db"),
         )
         reactions = Reactions(self.messages, self.privateConfig["chat"]["ignore"])
 
@@ -68,7 +81,7 @@ class VyxalBot2:
             self.privateConfig,
             0,
             datetime.now(),
-            userDB,
+            self.userDB,
             ghApp,
         )
         self.se = await SEService.create(reactions, common)
@@ -82,6 +95,7 @@ class VyxalBot2:
     async def shutdown(self, _):
         await self.se.shutdown()
         await self.discord.shutdown()
+        await self.userDB.close()
 
 
 def run():
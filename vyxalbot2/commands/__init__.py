@@ -9,6 +9,29 @@ import inspect
 from vyxalbot2.types import EventInfo
 
 
+@dataclass
+class CommandParameter:
+    name: str
+    annotation: Any
+    default: Any
+    # Maps each accepted value to its member if the parameter is an enum
+    enumValues: dict[str, Enum] | None
+
+    @property
+    def required(self):
+        return self.default is inspect.Parameter.empty
+
+    @property
+    def typeString(self):
+        if self.enumValues is not None:
+            typeString = "|".join(self.enumValues.keys())
+            if not self.required:
+                assert isinstance(self.default, self.annotation)
+                typeString += " = " + self.default.value
+            return typeString
+        return self.annotation.__name__
+
+
 class Command(dict[str, Self]):
     def __init__(
         self, name: str, doc: str, impl: Callable[..., AsyncGenerator[Any, None]]
@@ -17,27 +40,41 @@ class Command(dict[str, Self]):
         self.name = name
         self.helpStr = doc
         self.impl = impl
+        # Commands don't change after startup, so inspect them once here
+        # instead of every time they're parsed or their help is shown
+        self.signature = inspect.signature(impl)
+        self.parameters = self.genParameters()
+        self.fullHelp = self.genFullHelp()
 
     def __hash__(self):
         return hash(self.name)
 
-    @property
-    def fullHelp(self):
-        parameters = []
-        for parameter in inspect.signature(self.impl).parameters.values():
+    def genParameters(self):
+        parameters: list[CommandParameter] = []
+        for parameter in self.signature.parameters.values():
             if parameter.name in ("event", "self"):
                 continue
             if issubclass(parameter.annotation, Enum):
-                typeString = "|".join(member.value for member in parameter.annotation)
-                if parameter.default is not parameter.empty:
-                    assert isinstance(parameter.default, parameter.annotation)
-                    typeString += " = " + parameter.default.value
+                enumValues = {member.value: member for member in parameter.annotation}
             else:
-                typeString = parameter.annotation.__name__
-            if parameter.default is not parameter.empty:
-                parameters.append(f"[{parameter.name}: {typeString}]")
+                enumValues = None
+            parameters.append(
+                CommandParameter(
+                    parameter.name,
+                    parameter.annotation,
+                    parameter.default,
+                    enumValues,
+                )
+            )
+        return parameters
+
+    def genFullHelp(self):
+        parameters = []
+        for parameter in self.parameters:
+            if parameter.required:
+                parameters.append(f"<{parameter.name}: {parameter.typeString}>")
             else:
-                parameters.append(f"<{parameter.name}: {typeString}>")
+                parameters.append(f"[{parameter.name}: {parameter.typeString}]")
         return (
             (f"`!!/{self.name} " + " ".join(parameters)).strip() + "`: " + self.helpStr
         )
@@ -36,11 +36,37 @@ class CommonCommands(CommandSupplier):
         yield self.common.messages["info"]
 
     def status(self):
+        dropped = (
+            ", ".join(
+                f"{count} {event}"
+                for event, count in self.common.ghClient.dropped.most_common()
+            )
+            or "none"
+        )
+        deliveryTimes = (
+            ", ".join(
+                f"{sum(times) / len(times):.2f}s to {service}"
+                for service, times in self.common.ghClient.deliveryTimes.items()
+                if len(times)
+            )
+            or "none yet"
+        )
+        if (cache := self.common.userDB.cache) is not None:
+            stats = cache.stats()
+            userCache = f"{stats['size']} users, {stats['hitRate']:.0%} hit rate, {stats['evictions']} evicted"
+        else:
+            userCache = "disabled"
         return (
             f"Bot status: Online\n"
             f"Uptime: {datetime.now() - self.common.startupTime}\n"
             f"Running since: {self.common.startupTime.isoformat()}\n"
-            f"Errors since startup: {self.common.errorsSinceStartup}"
+            f"Errors since startup: {self.common.errorsSinceStartup}\n"
+            f"User cache: {userCache}\n"
+            f"Queued webhook deliveries: {len(self.common.ghClient.deliveries)}\n"
+            f"Duplicate webhook deliveries dropped: {self.common.ghClient.deliveries.duplicates}\n"
+            f"Unhandled webhook deliveries dropped: {dropped}\n"
+            f"Average webhook delivery time: {deliveryTimes}\n"
+            f"GitHub events coalesced: {self.common.ghClient.coalescer.coalesced} into {self.common.ghClient.coalescer.digests} digests"
         )
 
     async def statusCommand(
@@ -112,7 +138,10 @@ class CommonCommands(CommandSupplier):
         yield f"You are {'' if (event.userIdent == 354515) != (random.random() <= 0.1) else 'not '}lyxal."
 
     async def blameCommand(self, event: EventInfo):
-        yield f"It was {random.choice(await self.common.userDB.getUsers(event.service)).name}'s fault!"
+        if (name := await self.common.userDB.randomUser(event.service)) is None:
+            yield "It was nobody's fault!"
+        else:
+            yield f"It was {name}'s fault!"
 
     async def cookieCommand(self, event: EventInfo):
         """Bake a cookie. Maybe. You have to be worthy."""
@@ -77,6 +77,9 @@ class SECommands(CommonCommands):
         else:
             target = await self.userDB.getUserByName(self.service, name)
             if target is None:
+                similar = await self.userDB.searchUsers(self.service, name, 3)
+                if len(similar):
+                    return f"I don't know any user by that name. Did you mean: {', '.join(i.name for i in similar)}?"
                 return "I don't know any user by that name."
         return target
 
@@ -86,6 +89,8 @@ class SECommands(CommonCommands):
             yield target
             return
         yield f"User {target.name} is a member of groups {', '.join(target.groups)}."
+        if len(linked := (await self.userDB.linkedUsers([target]))[target.id]):
+            yield f"Linked accounts: {', '.join(f'{user.name} on {service}' for service, user in linked.items())}."
 
     async def permissionsModify(
         self, event: EventInfo, name: str, group: str, grant: bool
@@ -109,21 +114,17 @@ class SECommands(CommonCommands):
             yield "Insufficient permissions."
             return
         if grant:
-            if group in target.groups:
+            if not await self.userDB.addToGroup(target, group):
                 yield f"{target.name} is already a member of {group}."
-            else:
-                target.groups.append(group)
         else:
             if target.serviceIdent in self.groups[group].get("protected", {}).get(
                 self.service.name, []
             ):
                 yield "That user may not be removed."
-            elif group not in target.groups:
+            elif not await self.userDB.removeFromGroup(target, group):
                 yield f"That user is not in {group}."
             else:
-                target.groups.remove(group)
                 yield f"{target.name} removed from {group}."
-        await self.userDB.save(target)
 
     async def permissionsGrantCommand(self, event: EventInfo, name: str, group: str):
         """Add a user to a group."""
@@ -155,8 +156,7 @@ class SECommands(CommonCommands):
 
     async def refreshCommand(self, event: EventInfo):
         """Refresh your user information."""
-        user = await self.userDB.getUser(self.service, event.userIdent)
-        if user is None:
+        if await self.userDB.getUser(self.service, event.userIdent) is None:
             yield "You are not in my database. Please run !!/register."
             return
         async with ClientSession() as session:
@@ -164,11 +164,29 @@ class SECommands(CommonCommands):
                 f"https://chat.stackexchange.com/users/thumbs/{event.userIdent}"
             ) as response:
                 thumb = await response.json()
-        user.name = thumb["name"]
-        user.pfp = resolveChatPFP(thumb["email_hash"])
-        await self.userDB.save(user)
+        if not await self.userDB.refreshUser(
+            self.service,
+            event.userIdent,
+            thumb["name"],
+            resolveChatPFP(thumb["email_hash"]),
+        ):
+            yield "You are not in my database. Please run !!/register."
+            return
         yield "Your details have been updated."
 
+    async def runningCommand(self, event: EventInfo):
+        """List the commands I'm working on."""
+        for messageIdent, command, state, duration in self.service.runner.status():
+            yield f"[{command}](https://chat.stackexchange.com/transcript/message/{messageIdent}): {state} for {duration:.1f}s"
+        if len(times := self.service.firstResponseTimes):
+            yield f"Average time to first response: {sum(times) / len(times):.2f}s over the last {len(times)} commands"
+        edits = self.service.editDB.stats()
+        yield f"Editable responses: {edits['size']} kept, {edits['hits']} edits followed, {edits['misses']} not followed, {edits['evictions']} expired"
+        outbound = self.service.outbound.stats()
+        yield f"Chat requests: {outbound['throttles']} throttled, {outbound['interval']:.1f}s apart"
+        for priority, depth in outbound["depth"].items():
+            yield f"{priority.capitalize()} requests: {depth} queued, {outbound['averageWait'][priority]:.2f}s average wait, {outbound['maxWait'][priority]:.2f}s longest"
+
     async def groupsListCommand(self, event: EventInfo):
         """List all groups known to the bot."""
         yield "All groups: " + ", ".join(self.groups.keys())
@@ -177,7 +195,12 @@ class SECommands(CommonCommands):
         """List all members of a group."""
         group = group.removesuffix("s")
         yield f"Members of {group}: " + ", ".join(
-            map(lambda i: i.name, await self.userDB.membersOfGroup(self.service, group))
+            [
+                name
+                async for _, name in self.userDB.memberIdentsOfGroup(
+                    self.service, group
+                )
+            ]
         )
 
     async def pingCommand(self, event: EventInfo, group: str, message: str):
@@ -185,9 +208,11 @@ class SECommands(CommonCommands):
         group = group.removesuffix("s")
         pings = " ".join(
             [
-                "@" + target.name
-                for target in await self.userDB.membersOfGroup(self.service, group)
-                if target.serviceIdent != event.userIdent
+                "@" + name
+                async for ident, name in self.userDB.memberIdentsOfGroup(
+                    self.service, group
+                )
+                if ident != event.userIdent
             ]
         )
         if not len(pings):
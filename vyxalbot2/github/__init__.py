@@ -1,6 +1,7 @@
 from typing import Optional
-from collections import Counter, defaultdict
-from time import time
+from asyncio import Task, create_task, gather
+from collections import Counter, defaultdict, deque
+from time import monotonic, time
 
 import re
 import json
@@ -10,7 +11,6 @@ import traceback
 from aiohttp import ClientSession
 from aiohttp.web import Application, Request, Response
 from gidgethub.aiohttp import GitHubAPI as AsyncioGitHubAPI
-from gidgethub.routing import Router
 from gidgethub.sansio import Event as GitHubEvent
 from gidgethub.apps import get_installation_access_token
 from dateutil.parser import parse as parseDatetime
@@ -19,9 +19,15 @@ from jwt import encode as encodeJwt
 
 from vyxalbot2.services import PinThat, Service
 from vyxalbot2.types import AppToken, PublicConfigType
+from vyxalbot2.github.coalesce import Burstable, Coalescer
+from vyxalbot2.github.deliveries import Delivery, DeliveryQueue
+from vyxalbot2.github.webhooks import EventRouter, dumpJSON, loadJSON, parseEvent
 from vyxalbot2.github.formatters import (
     formatIssue,
+    formatPRDigest,
+    formatPushDigest,
     formatRef,
+    formatRefDigest,
     formatRepo,
     formatUser,
     msgify,
@@ -36,14 +42,21 @@ def wrap(fun):
         services: list[Service],
         gh: AsyncioGitHubAPI,
     ):
-        lines = [i async for i in fun(self, event)]
-        for service in services:
-            ids = []
-            for line in lines:
-                if line == PinThat:
-                    await service.pin(ids[-1])
-                    continue
-                ids.append(await service.send(line, discordSuppressEmbeds=True))
+        # Nothing is handed to the coalescer until the handler has finished, so
+        # a handler that fails part way through doesn't leave events held back
+        items = [line async for line in fun(self, event)]
+        lines = []
+        for line in items:
+            if isinstance(line, Burstable):
+                lines.extend(
+                    self.coalescer.submit(
+                        event.data["repository"]["name"], line, event.delivery_id
+                    )
+                )
+            else:
+                lines.append(line)
+        if len(lines):
+            await self.broadcast(services, lines, f"delivery #{event.delivery_id}")
 
     return wrapper
 
@@ -56,6 +69,9 @@ class GitHubApplication(Application):
         appId: str,
         account: str,
         webhookSecret: str,
+        queuePath: str,
+        workers: int = 1,
+        maxAttempts: int = 3,
     ):
         super().__init__()
         self.services = []
@@ -66,10 +82,34 @@ class GitHubApplication(Application):
         self.publicConfig = publicConfig
 
         self._appToken: Optional[AppToken] = None
-        self.ghRouter = Router()
+        self.ghRouter = EventRouter()
         self.cache = LRUCache(maxsize=5000)
         self.gh = AsyncioGitHubAPI(ClientSession(), "VyxalBot2", cache=self.cache)
 
+        # Deliveries are handled in the background, so GitHub isn't left
+        # waiting on chat. With one worker they're handled in the order they
+        # arrived in, like they used to be.
+        self.deliveries = DeliveryQueue(queuePath)
+        self.workerCount = workers
+        self.maxAttempts = maxAttempts
+        self.workers: list[Task] = []
+        # Deliveries being handled, or with events held back for a digest. They
+        # stay queued until the digest is sent, so a restart doesn't lose them.
+        self.handling: dict[str, Delivery] = {}
+        # Of those, the ones a worker is still handling, which the worker will
+        # finish itself, and the ones whose digest failed while it was
+        self.inHandler: set[str] = set()
+        self.undelivered: set[str] = set()
+        # How long sending each delivery's lines took, by service
+        self.deliveryTimes: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=100)
+        )
+        self.coalescer = Coalescer(publicConfig.get("coalesce", {}), self.sendDigest)
+        # Deliveries we didn't handle, by event type
+        self.dropped: Counter[str] = Counter()
+        self.on_startup.append(self.startWorkers)
+        self.on_shutdown.append(self.stopWorkers)
+
         self.router.add_post("/webhook", self.onHookRequest)
         self.ghRouter.add(self.onPushAction, "push")
         self.ghRouter.add(self.onIssueAction, "issues")
@@ -119,41 +159,166 @@ class GitHubApplication(Application):
 
     def writeErrorReport(self, event: GitHubEvent, error: Exception):
         os.makedirs("errorlogs/gh/", exist_ok=True)
-        with open(f"errorlogs/gh/{event.delivery_id}.txt") as file:
+        with open(f"errorlogs/gh/{event.delivery_id}.txt", "w") as file:
             file.write(f"--- Error log for Github delivery {event.delivery_id}\n")
             file.write("\n\n--- Traceback information:\n")
             file.writelines(traceback.format_exception(error))
             file.write("\n\n--- Delivery data:\n")
             file.write(json.dumps(event.data, indent=4))
+
+    async def reportError(self, msg: str):
+        try:
+            for service in self.services:
+                await service.send(f"@Ginger " + msg)
+        except RuntimeError:
+            pass
+
+    async def startWorkers(self, _):
+        if len(self.deliveries):
+            self.logger.info(f"Resuming {len(self.deliveries)} queued deliveries")
+        self.workers = [
+            create_task(self.deliveryWorker()) for _ in range(self.workerCount)
+        ]
+
+    async def stopWorkers(self, _):
+        for worker in self.workers:
+            worker.cancel()
+        try:
+            await self.coalescer.flush()
+        finally:
+            self.deliveries.close()
+
     async def onHookRequest(self, request: Request) -> Response:
-        event = None
+        # Most deliveries (pings, CI statuses and so on) are for events we have
+        # no handlers for, and the header is enough to tell
+        if request.headers.get("x-github-event", "") not in self.ghRouter.routes:
+            # Nothing has been verified yet, so the header can be anything and
+            # mustn't become a key of its own
+            self.dropped["other"] += 1
+            return Response(status=200)
         try:
             body = await request.read()
-            event = GitHubEvent.from_http(
-                request.headers, body, secret=self.webhookSecret
-            )
-            self.logger.info(f"Recieved delivery #{event.delivery_id} ({event.event})")
-            if event.event == "ping":
+            event = parseEvent(request.headers, body, self.webhookSecret)
+        except Exception:
+            msg = "An error occured while processing a request!"
+            self.logger.exception(msg)
+            await self.reportError(msg)
+            return Response(status=500)
+        self.logger.info(f"Recieved delivery #{event.delivery_id} ({event.event})")
+        if not self.ghRouter.handles(event.event, event.data.get("action")):
+            self.dropped[event.event] += 1
+            return Response(status=200)
+        if repo := event.data.get("repository", False):
+            if (
+                repo["visibility"] == "private"
+                or repo["name"] in self.publicConfig["ignoredRepositories"]
+            ):
+                self.dropped[event.event] += 1
                 return Response(status=200)
-            if repo := event.data.get("repository", False):
-                if repo["visibility"] == "private":
-                    return Response(status=200)
-                if repo["name"] in self.publicConfig["ignoredRepositories"]:
-                    return Response(status=200)
-            await self.ghRouter.dispatch(event, self.services, self.gh)
+        if not self.deliveries.put(
+            event.delivery_id, event.event, dumpJSON(event.data)
+        ):
+            self.logger.info(f"Dropped duplicate delivery #{event.delivery_id}")
             return Response(status=200)
-        except Exception:
-            if event:
-                msg = f"An error occured while processing event {event.delivery_id}!"
+        return Response(status=202)
+
+    async def deliveryWorker(self):
+        while True:
+            delivery = await self.deliveries.get()
+            self.handling[delivery.deliveryId] = delivery
+            self.inHandler.add(delivery.deliveryId)
+            try:
+                await self.handleDelivery(delivery)
+            except Exception:
+                failed = True
             else:
-                msg = f"An error occured while processing a request!"
+                failed = delivery.deliveryId in self.undelivered
+            finally:
+                self.inHandler.discard(delivery.deliveryId)
+                self.undelivered.discard(delivery.deliveryId)
+            if failed:
+                self.coalescer.withdraw(delivery.deliveryId)
+                self.handling.pop(delivery.deliveryId, None)
+                self.deliveries.retry(delivery)
+            elif not self.coalescer.holds(delivery.deliveryId):
+                self.handling.pop(delivery.deliveryId, None)
+                self.deliveries.done(delivery)
+
+    async def handleDelivery(self, delivery: Delivery):
+        event = GitHubEvent(
+            loadJSON(delivery.data),
+            event=delivery.event,
+            delivery_id=delivery.deliveryId,
+        )
+        try:
+            await self.ghRouter.dispatch(event, self.services, self.gh)
+        except Exception as error:
+            msg = f"An error occured while processing event {event.delivery_id}!"
             self.logger.exception(msg)
-            try:
-                for service in self.services:
-                    await service.send(f"@Ginger " + msg)
-            except RuntimeError:
-                pass
-            return Response(status=500)
+            if delivery.attempts + 1 < self.maxAttempts:
+                raise
+            # That was its last chance, so give up on it and tell someone
+            self.deliveries.forget(delivery)
+            self.writeErrorReport(event, error)
+            await self.reportError(msg)
+
+    async def broadcast(self, services: list[Service], lines: list, what: str):
+        # Every service gets its lines at the same time, so a slow or broken
+        # one doesn't hold the others up
+        results = await gather(
+            *(self.deliver(service, lines) for service in services),
+            return_exceptions=True,
+        )
+        failed = 0
+        for service, result in zip(services, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self.logger.error(
+                    f"Failed to send {what} to {service.name}", exc_info=result
+                )
+        # Only worth trying again if nobody got anything
+        if failed and failed == len(services):
+            raise next(i for i in results if isinstance(i, Exception))
+
+    async def sendDigest(self, lines: list, deliveryIds: list[str]) -> bool:
+        try:
+            await self.broadcast(self.services, lines, "a digest")
+        except Exception:
+            error = True
+        else:
+            error = False
+        gaveUp = []
+        for deliveryId in deliveryIds:
+            if deliveryId in self.inHandler:
+                if error:
+                    self.undelivered.add(deliveryId)
+                continue
+            if (delivery := self.handling.pop(deliveryId, None)) is None:
+                continue
+            if not error:
+                self.deliveries.done(delivery)
+            elif delivery.attempts + 1 < self.maxAttempts:
+                # Handling them again submits their events again
+                self.deliveries.retry(delivery)
+            else:
+                self.deliveries.forget(delivery)
+                self.deliveries.done(delivery)
+                gaveUp.append(deliveryId)
+        if len(gaveUp):
+            await self.reportError(
+                f"Failed to send a digest of deliveries {', '.join(gaveUp)}!"
+            )
+        return not error
+
+    async def deliver(self, service: Service, lines: list):
+        start = monotonic()
+        ids = []
+        for line in lines:
+            if line == PinThat:
+                await service.pin(ids[-1])
+                continue
+            ids.append(await service.send(line, discordSuppressEmbeds=True))
+        self.deliveryTimes[service.name].append(monotonic() - start)
 
     async def autoTagPR(self, event: GitHubEvent):
         pullRequest = event.data["pull_request"]
@@ -205,6 +370,9 @@ class GitHubApplication(Application):
         branch = "/".join(event.data["ref"].split("/")[2:])
         verb = "force-push" if event.data["forced"] else "push"
         commits = list(filter(lambda commit: commit["distinct"], event.data["commits"]))
+        if not len(commits):
+            return
+        lines = []
         if len(commits) <= 5:
             for commit in commits:
                 if event.data["pusher"]["name"] == event.data["sender"]["login"]:
@@ -215,7 +383,9 @@ class GitHubApplication(Application):
                     message = "(no title)"
                 else:
                     message = commit["message"].splitlines()[0]
-                yield f"{user} {verb}ed a [commit]({commit['url']}) to {formatRef(branch, event.data['repository'])} in {formatRepo(event.data['repository'])}: {message}"
+                lines.append(
+                    f"{user} {verb}ed a [commit]({commit['url']}) to {formatRef(branch, event.data['repository'])} in {formatRepo(event.data['repository'])}: {message}"
+                )
         else:
             counter = Counter()
             commitsByUser = defaultdict(lambda: [])
@@ -231,7 +401,26 @@ class GitHubApplication(Application):
                     message = "(no title)"
                 else:
                     message = userCommits[-1]["message"].splitlines()[0]
-                yield f"{user} {verb}ed {count} commits ([s]({userCommits[0]['url']}) [e]({userCommits[-1]['url']})) to {formatRef(branch, event.data['repository'])} in {formatRepo(event.data['repository'])}: {message}"
+                lines.append(
+                    f"{user} {verb}ed {count} commits ([s]({userCommits[0]['url']}) [e]({userCommits[-1]['url']})) to {formatRef(branch, event.data['repository'])} in {formatRepo(event.data['repository'])}: {message}"
+                )
+        if event.data["pusher"]["name"] == event.data["sender"]["login"]:
+            pusher = formatUser(event.data["sender"])
+        else:
+            pusher = event.data["pusher"]["name"]
+        yield Burstable(
+            "push",
+            branch,
+            lines,
+            (
+                pusher,
+                len(commits),
+                event.data["forced"],
+                branch,
+                event.data["repository"],
+            ),
+            formatPushDigest,
+        )
 
     @wrap
     async def onIssueAction(self, event: GitHubEvent):
@@ -263,14 +452,41 @@ class GitHubApplication(Application):
                 assignee = event.data["assignee"]
                 yield f'{formatUser(event.data["sender"])} unassigned {formatUser(assignee)} from pull request {formatIssue(pullRequest)} in {formatRepo(event.data["repository"])}'
             case "closed":
-                yield f'{formatUser(event.data["sender"])} {"merged" if pullRequest["merged"] else "closed"} pull request {formatIssue(pullRequest)} in {formatRepo(event.data["repository"])}'
+                verb = "merged" if pullRequest["merged"] else "closed"
+                yield Burstable(
+                    "pull_request",
+                    verb,
+                    [
+                        f'{formatUser(event.data["sender"])} {verb} pull request {formatIssue(pullRequest)} in {formatRepo(event.data["repository"])}'
+                    ],
+                    (
+                        formatUser(event.data["sender"]),
+                        verb,
+                        pullRequest,
+                        event.data["repository"],
+                    ),
+                    formatPRDigest,
+                )
             case "review_requested":
                 return  # user doesn't want this apparently
                 yield f'{formatUser(event.data["sender"])} requested {formatUser(event.data["requested_reviewer"])}\'s review on {formatIssue(pullRequest)}'
             case "ready_for_review":
                 yield f'{formatUser(event.data["sender"])} marked pull request {formatIssue(pullRequest)} ready for review'
             case _ as action if action in ["opened", "reopened", "enqueued"]:
-                yield f'{formatUser(event.data["sender"])} {action} pull request {formatIssue(pullRequest)} in {formatRepo(event.data["repository"])}'
+                yield Burstable(
+                    "pull_request",
+                    action,
+                    [
+                        f'{formatUser(event.data["sender"])} {action} pull request {formatIssue(pullRequest)} in {formatRepo(event.data["repository"])}'
+                    ],
+                    (
+                        formatUser(event.data["sender"]),
+                        action,
+                        pullRequest,
+                        event.data["repository"],
+                    ),
+                    formatPRDigest,
+                )
                 if action == "opened":
                     await self.autoTagPR(event)
 
@@ -280,7 +496,21 @@ class GitHubApplication(Application):
             return
         if event.data["sender"]["login"] == GITHUB_MERGE_QUEUE:
             return
-        yield f'{formatUser(event.data["sender"])} created {event.data["ref_type"]} {event.data["ref"]} in {formatRepo(event.data["repository"])}'
+        yield Burstable(
+            "create",
+            event.data["ref_type"],
+            [
+                f'{formatUser(event.data["sender"])} created {event.data["ref_type"]} {event.data["ref"]} in {formatRepo(event.data["repository"])}'
+            ],
+            (
+                formatUser(event.data["sender"]),
+                "created",
+                event.data["ref_type"],
+                event.data["ref"],
+                event.data["repository"],
+            ),
+            formatRefDigest,
+        )
 
     @wrap
     async def onThingDeleted(self, event: GitHubEvent):
@@ -289,7 +519,21 @@ class GitHubApplication(Application):
             or event.data["sender"]["login"] == GITHUB_MERGE_QUEUE
         ):
             return
-        yield f'{formatUser(event.data["sender"])} deleted {event.data["ref_type"]} {event.data["ref"]} in {formatRepo(event.data["repository"])}'
+        yield Burstable(
+            "delete",
+            event.data["ref_type"],
+            [
+                f'{formatUser(event.data["sender"])} deleted {event.data["ref_type"]} {event.data["ref"]} in {formatRepo(event.data["repository"])}'
+            ],
+            (
+                formatUser(event.data["sender"]),
+                "deleted",
+                event.data["ref_type"],
+                event.data["ref"],
+                event.data["repository"],
+            ),
+            formatRefDigest,
+        )
 
     @wrap
     async def onReleaseCreated(self, event: GitHubEvent):
@@ -0,0 +1,109 @@
+from asyncio import Task, create_task, sleep
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable
+
+import logging
+
+
+@dataclass
+class Burstable:
+    # Yielded by a handler instead of its lines when lots of similar events
+    # arriving together should be posted as one digest. kind is what the
+    # window is configured by, and events with the same kind and key in the
+    # same repository are part of the same burst. digest turns the items of
+    # every event in a burst into a single line.
+    kind: str
+    key: Hashable
+    lines: list[Any]
+    item: Any
+    digest: Callable[[list[Any]], str]
+
+
+class Coalescer:
+    # The first event of a burst is posted straight away, so lone events
+    # aren't held up. Anything like it that arrives within the window is held
+    # back, and posted as one digest (or as itself, if it was the only one)
+    # when the window ends. A new window then starts, so a long storm of
+    # events becomes one digest per window. Each event is submitted with the
+    # ident of whatever it came from, and send is given the idents of the
+    # events it's sending, so the caller knows when they've been dealt with.
+    # send returns whether the lines were sent.
+    def __init__(
+        self,
+        windows: dict[str, dict[str, float]],
+        send: Callable[[list[Any], list[Hashable]], Awaitable[bool]],
+    ):
+        self.logger = logging.getLogger("Coalescer")
+        self.windows = windows
+        self.send = send
+        self.bursts: dict[
+            tuple[str, str, Hashable], list[tuple[Burstable, Hashable]]
+        ] = {}
+        self.timers: dict[tuple[str, str, Hashable], Task] = {}
+
+        self.coalesced = 0
+        self.digests = 0
+
+    def window(self, repo: str, kind: str) -> float:
+        default = self.windows.get("*", {}).get(kind, 0)
+        return self.windows.get(repo, {}).get(kind, default)
+
+    def submit(self, repo: str, burstable: Burstable, ident: Hashable):
+        # Returns the lines that should be sent now
+        if (window := self.window(repo, burstable.kind)) <= 0:
+            return burstable.lines
+        key = (repo, burstable.kind, burstable.key)
+        if key in self.bursts:
+            self.bursts[key].append((burstable, ident))
+            return []
+        self.bursts[key] = []
+        self.timers[key] = create_task(self.close(key, window))
+        return burstable.lines
+
+    def holds(self, ident: Hashable):
+        return any(ident == i for burst in self.bursts.values() for _, i in burst)
+
+    def withdraw(self, ident: Hashable):
+        # For events whose source is going to be handled again
+        for burst in self.bursts.values():
+            burst[:] = [i for i in burst if i[1] != ident]
+
+    async def sendBurst(self, key: tuple[str, str, Hashable]):
+        pending = self.bursts[key]
+        self.bursts[key] = []
+        idents = [ident for _, ident in pending]
+        if len(pending) == 1:
+            await self.send(pending[0][0].lines, idents)
+            return
+        # Only counted once it's sent, since events in a digest that failed
+        # are submitted again
+        if await self.send(
+            [pending[-1][0].digest([i.item for i, _ in pending])], idents
+        ):
+            self.coalesced += len(pending)
+            self.digests += 1
+
+    async def close(self, key: tuple[str, str, Hashable], window: float):
+        try:
+            while True:
+                await sleep(window)
+                if not len(self.bursts[key]):
+                    break
+                try:
+                    await self.sendBurst(key)
+                except Exception:
+                    self.logger.exception(f"Failed to send a digest for {key}")
+        finally:
+            self.bursts.pop(key, None)
+            self.timers.pop(key, None)
+
+    async def flush(self):
+        # Sends everything that's being held back, for when we're shutting down
+        for key, timer in list(self.timers.items()):
+            timer.cancel()
+            if not len(self.bursts.get(key, [])):
+                continue
+            try:
+                await self.sendBurst(key)
+            except Exception:
+                self.logger.exception(f"Failed to send a digest for {key}")
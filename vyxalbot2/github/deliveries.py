@@ -0,0 +1,154 @@
+from asyncio import Event, wait_for
+from dataclasses import dataclass
+from time import time
+
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    deliveryId TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    availableAt REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_availableAt ON deliveries (availableAt);
+CREATE TABLE IF NOT EXISTS seen (
+    deliveryId TEXT PRIMARY KEY,
+    seenAt REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_seenAt ON seen (seenAt);
+"""
+# GitHub only lets deliveries be redelivered for three days after they're made
+SEEN_WINDOW = 60 * 60 * 24 * 3
+SEEN_SIZE = 50000
+
+
+@dataclass
+class Delivery:
+    ident: int
+    deliveryId: str
+    event: str
+    data: str
+    attempts: int
+
+
+class DeliveryQueue:
+    # Webhook deliveries we've accepted but not yet handled, kept on disk so
+    # that nothing GitHub has been told we received is lost if we restart.
+    # A delivery is only removed once it's been handled, so anything that was
+    # in progress when we stopped is handled again when we start back up.
+    # Delivery IDs are remembered for a while, so that a delivery GitHub sends
+    # again (because it timed out, or someone pressed redeliver) is dropped.
+    def __init__(
+        self,
+        path: str,
+        retryDelay: float = 5,
+        seenWindow: float = SEEN_WINDOW,
+        seenSize: int = SEEN_SIZE,
+    ):
+        self.db = sqlite3.connect(path)
+        # Acknowledging a delivery promises we have it, so wait for the disk
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = FULL")
+        with self.db:
+            self.db.executescript(SCHEMA)
+        self.retryDelay = retryDelay
+        self.seenWindow = seenWindow
+        self.seenSize = seenSize
+        # Kept here so that checking the size doesn't need a count(*)
+        self.seenCount = self.db.execute("SELECT count(*) FROM seen").fetchone()[0]
+        self.duplicates = 0
+        self.claimed: set[int] = set()
+        self.pending = Event()
+        self.pending.set()
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM deliveries").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def put(self, deliveryId: str, event: str, data: str):
+        # Returns False, without queueing anything, if we've seen it before
+        now = time()
+        with self.db:
+            # Both of these only visit the rows they delete, from the old end
+            # of the seenAt index
+            self.seenCount -= self.db.execute(
+                "DELETE FROM seen WHERE seenAt < ?", (now - self.seenWindow,)
+            ).rowcount
+            if not self.db.execute(
+                "INSERT OR IGNORE INTO seen VALUES (?, ?)", (deliveryId, now)
+            ).rowcount:
+                self.duplicates += 1
+                return False
+            self.seenCount += 1
+            if self.seenCount > self.seenSize:
+                self.seenCount -= self.db.execute(
+                    """DELETE FROM seen WHERE deliveryId IN (
+                        SELECT deliveryId FROM seen ORDER BY seenAt LIMIT ?
+                    )""",
+                    (self.seenCount - self.seenSize,),
+                ).rowcount
+            self.db.execute(
+                """INSERT INTO deliveries (deliveryId, event, data, availableAt)
+                VALUES (?, ?, ?, ?)""",
+                (deliveryId, event, data, now),
+            )
+        self.pending.set()
+        return True
+
+    def forget(self, delivery: Delivery):
+        # For deliveries we gave up on, so that redelivering them tries again
+        with self.db:
+            self.seenCount -= self.db.execute(
+                "DELETE FROM seen WHERE deliveryId = ?", (delivery.deliveryId,)
+            ).rowcount
+
+    def next(self):
+        return self.db.execute(
+            """SELECT id, deliveryId, event, data, attempts, availableAt
+            FROM deliveries WHERE id NOT IN (SELECT value FROM json_each(?))
+            ORDER BY availableAt, id LIMIT 1""",
+            (json.dumps(list(self.claimed)),),
+        ).fetchone()
+
+    async def get(self):
+        # Waits for the oldest delivery that nobody else is handling and
+        # isn't waiting to be retried
+        while True:
+            self.pending.clear()
+            if (row := self.next()) is not None:
+                *fields, availableAt = row
+                if availableAt <= time():
+                    self.claimed.add(row[0])
+                    return Delivery(*fields)
+                timeout = availableAt - time()
+            else:
+                timeout = None
+            try:
+                await wait_for(self.pending.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def done(self, delivery: Delivery):
+        with self.db:
+            self.db.execute("DELETE FROM deliveries WHERE id = ?", (delivery.ident,))
+        self.claimed.discard(delivery.ident)
+
+    def retry(self, delivery: Delivery):
+        delivery.attempts += 1
+        with self.db:
+            self.db.execute(
+                "UPDATE deliveries SET attempts = ?, availableAt = ? WHERE id = ?",
+                (
+                    delivery.attempts,
+                    time() + self.retryDelay * 2 ** (delivery.attempts - 1),
+                    delivery.ident,
+                ),
+            )
+        self.claimed.discard(delivery.ident)
+        self.pending.set()
@@ -27,3 +27,43 @@ def formatIssue(issue: dict) -> str:
 
 def formatRef(ref: str, repo: dict) -> str:
     return f'[{repo["name"]}/{ref}]({repo["html_url"]}/tree/{ref})'
+
+
+def formatUsers(users: list[str]) -> str:
+    users = list(dict.fromkeys(users))
+    if len(users) <= 2:
+        return " and ".join(users)
+    return ", ".join(users[:-1]) + " and " + users[-1]
+
+
+def formatList(items: list[str], limit: int = 5) -> str:
+    if len(items) <= limit:
+        return ", ".join(items)
+    return ", ".join(items[:limit]) + f" and {len(items) - limit} more"
+
+
+def formatPushDigest(pushes: list[tuple[str, int, bool, str, dict]]) -> str:
+    # Each push is (user, commit count, forced, branch, repository)
+    users = formatUsers([push[0] for push in pushes])
+    commits = sum(push[1] for push in pushes)
+    verb = "force-pushed" if any(push[2] for push in pushes) else "pushed"
+    branch, repo = pushes[-1][3], pushes[-1][4]
+    return f"{users} {verb} {commits} commits across {len(pushes)} pushes to {formatRef(branch, repo)} in {formatRepo(repo)}"
+
+
+def formatRefDigest(refs: list[tuple[str, str, str, str, dict]]) -> str:
+    # Each ref is (user, verb, ref type, ref name, repository)
+    users = formatUsers([ref[0] for ref in refs])
+    verb, refType, repo = refs[-1][1], refs[-1][2], refs[-1][4]
+    names = formatList([ref[3] for ref in refs])
+    return f"{users} {verb} {len(refs)} {refType}{'es' if refType.endswith('h') else 's'} in {formatRepo(repo)}: {names}"
+
+
+def formatPRDigest(pullRequests: list[tuple[str, str, dict, dict]]) -> str:
+    # Each pull request is (user, verb, pull request, repository)
+    users = formatUsers([pullRequest[0] for pullRequest in pullRequests])
+    verb, repo = pullRequests[-1][1], pullRequests[-1][3]
+    links = formatList(
+        [f'[#{i[2]["number"]}]({i[2]["html_url"]})' for i in pullRequests]
+    )
+    return f"{users} {verb} {len(pullRequests)} pull requests in {formatRepo(repo)}: {links}"
@@ -0,0 +1,65 @@
+from typing import Any, Mapping, Optional
+
+import json
+
+from gidgethub import ValidationFailure
+from gidgethub.routing import Router
+from gidgethub.sansio import Event as GitHubEvent, validate_event
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loadJSON(data: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumpJSON(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+
+def parseEvent(headers: Mapping[str, str], body: bytes, secret: str):
+    # The same as GitHubEvent.from_http, except that JSON bodies are decoded
+    # with orjson when it's installed
+    if headers.get("content-type", "").partition(";")[0].strip() != "application/json":
+        return GitHubEvent.from_http(headers, body, secret=secret)
+    signature = headers.get("x-hub-signature-256", headers.get("x-hub-signature"))
+    if signature is None:
+        raise ValidationFailure("signature is missing")
+    validate_event(body, signature=signature, secret=secret)
+    return GitHubEvent(
+        loadJSON(body),
+        event=headers["x-github-event"],
+        delivery_id=headers["x-github-delivery"],
+    )
+
+
+class EventRouter(Router):
+    # Remembers which events, and which of their actions, have handlers, so
+    # that deliveries nothing would handle can be dropped without decoding them
+    def __init__(self):
+        super().__init__()
+        # None means every action of that event is handled
+        self.routes: dict[str, Optional[set[str]]] = {}
+
+    def add(self, func, event_type: str, **data_detail: Any):
+        super().add(func, event_type, **data_detail)
+        actions = self.routes.get(event_type, set())
+        if actions is None:
+            return
+        if data_detail.keys() == {"action"}:
+            self.routes[event_type] = actions | {data_detail["action"]}
+        else:
+            self.routes[event_type] = None
+
+    def handles(self, event: str, action: Optional[str]):
+        if event not in self.routes:
+            return False
+        actions = self.routes[event]
+        return actions is None or action in actions
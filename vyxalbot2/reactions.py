@@ -37,33 +37,76 @@ MESSAGE_REGEXES_IN: dict[tuple[str, ...], str] = {
 MESSAGE_REGEXES: dict[str, str] = dict(
     chain.from_iterable(zip(k, repeat(v)) for k, v in MESSAGE_REGEXES_IN.items())
 )
+# Messages longer than this are never reacted to; nobody is saying "hello" in a wall of text
+MAX_REACTION_LENGTH = 512
+
+
+def combinePatterns(patterns: list[str]):
+    # Named groups may repeat between patterns, and the combined regex is only
+    # used to tell whether *any* pattern matches, so drop the names
+    return re.compile(
+        "|".join(f"(?:{re.sub(r'[(][?]P<[^>]+>', '(?:', i)})" for i in patterns)
+    )
+
+
+class ReactionMatcher:
+    def __init__(self, regexes: dict[str, str]):
+        self.regexes = [
+            (re.compile(regex), function, function not in DO_NOT_IGNORE_COMMAND_PREFIX)
+            for regex, function in regexes.items()
+        ]
+        # One combined regex per kind of input, so the common case of a message
+        # matching nothing at all costs one pass per kind instead of one per pattern
+        self.stripped = combinePatterns(
+            [regex.pattern for regex, _, strip in self.regexes if strip]
+        )
+        self.unstripped = combinePatterns(
+            [regex.pattern for regex, _, strip in self.regexes if not strip]
+        )
+
+    def match(self, content: str):
+        if len(content) > MAX_REACTION_LENGTH:
+            return
+        content = content.lower()
+        strippedContent = content.removeprefix("!!/")
+        strippedHit = self.stripped.fullmatch(strippedContent) is not None
+        unstrippedHit = self.unstripped.fullmatch(content) is not None
+        if not (strippedHit or unstrippedHit):
+            return
+        for regex, function, strip in self.regexes:
+            if strip:
+                if not strippedHit:
+                    continue
+                reMatch = regex.fullmatch(strippedContent)
+            else:
+                if not unstrippedHit:
+                    continue
+                reMatch = regex.fullmatch(content)
+            if reMatch is not None:
+                yield function, reMatch
 
 
 class Reactions:
     def __init__(self, messages: MessagesType, ignore: list[int]):
         self.messages = messages
         self.ignore = ignore
+        self.matcher = ReactionMatcher(MESSAGE_REGEXES)
 
     async def runCommand(self, service: Service, name: str, event: EventInfo, *args):
         async for line in service.invokeCommand(name, event, *args):
             yield line
 
     async def onMessage(self, service: Service, event: EventInfo):
-        for regex, function in MESSAGE_REGEXES.items():
-            if function not in DO_NOT_IGNORE_COMMAND_PREFIX:
-                reMatch = re.fullmatch(regex, event.content.lower().removeprefix("!!/"))
-            else:
-                reMatch = re.fullmatch(regex, event.content.lower())
-            if reMatch is not None:
-                if (
-                    event.userIdent == event.service.clientIdent
-                    and function not in OK_TO_SELF_REPLY
-                ):
-                    continue
-                if event.userIdent in self.ignore:
-                    continue
-                async for line in getattr(self, function)(service, event, reMatch):
-                    yield line
+        if event.userIdent in self.ignore:
+            return
+        for function, reMatch in self.matcher.match(event.content):
+            if (
+                event.userIdent == event.service.clientIdent
+                and function not in OK_TO_SELF_REPLY
+            ):
+                continue
+            async for line in getattr(self, function)(service, event, reMatch):
+                yield line
 
     async def info(self, service: Service, event: EventInfo, reMatch: re.Match):
         async for line in self.runCommand(service, "info", event):
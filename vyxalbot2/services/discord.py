@@ -13,7 +13,8 @@ from vyxalbot2.commands import Command
 from vyxalbot2.commands.discord import DiscordCommands
 from vyxalbot2.services import Service
 from vyxalbot2.reactions import Reactions
-from vyxalbot2.types import CommandImpl, CommonData, EventInfo
+from vyxalbot2.types import CommonData, EventInfo
+from vyxalbot2.util import knownPFP
 
 
 class VBClient(Client):
@@ -23,7 +24,7 @@ class VBClient(Client):
         self.statuses = statuses
         self.tree = CommandTree(self)
 
-    def wrap(self, service: "DiscordService", impl: CommandImpl):
+    def wrap(self, service: "DiscordService", command: Command):
         # discord.py checks the signature of the wrapper to generate autocomplete,
         # so we inject the wrapped function's signature into the wrapper via dark Python magicks
         # do note: this operation does not actually change the signature of the function!
@@ -32,11 +33,11 @@ class VBClient(Client):
         # TL;DR I used the inspect to bamboozle the inspect
         async def wrapper(interaction: Interaction, *args, **kwargs):
             assert interaction.channel_id is not None
-            async for line in impl(
+            async for line in command.impl(
                 EventInfo(
                     "",  # :(
                     interaction.user.display_name,
-                    interaction.user.display_avatar.url,
+                    knownPFP(interaction.user.display_avatar.url),
                     interaction.user.id,
                     interaction.channel_id,
                     interaction.id,
@@ -52,7 +53,7 @@ class VBClient(Client):
         wrapper.__signature__ = wrapSig.replace(
             parameters=[
                 wrapSig.parameters["interaction"],
-                *tuple(inspect.signature(impl).parameters.values())[1:],
+                *tuple(command.signature.parameters.values())[1:],
             ]
         )
         return wrapper
@@ -89,7 +90,7 @@ class VBClient(Client):
             DiscordCommand(
                 name=parts[0],
                 description=command.helpStr,
-                callback=self.wrap(service, command.impl),
+                callback=self.wrap(service, command),
                 parent=parent,
             )
         )
@@ -143,7 +144,7 @@ class DiscordService(Service):
         event = EventInfo(
             content=message.content,
             userName=message.author.display_name,
-            pfp=message.author.display_avatar.url,
+            pfp=knownPFP(message.author.display_avatar.url),
             roomIdent=message.channel.id,
             userIdent=message.author.id,
             messageIdent=message.id,
@@ -1,24 +1,42 @@
-from typing import cast
-from datetime import datetime
-from urllib.parse import urlparse, urlunparse
+from typing import Awaitable, Callable, TypeVar, cast
+from asyncio import Future, Task, create_task, shield
+from collections import deque
+from functools import partial
+from time import monotonic
 
 import random
 import logging
 
 from aiohttp import ClientSession
 from bs4 import BeautifulSoup, Tag
+from cachetools import TTLCache
 from sechat import Bot, EventType
 from sechat.room import Room
-from sechat.events import MessageEvent, EditEvent
+from sechat.events import MessageEvent, EditEvent, DeleteEvent
 from markdownify import MarkdownConverter
 
 from vyxalbot2.commands.se import SECommands
 from vyxalbot2.reactions import Reactions
 from vyxalbot2.services import PinThat, Service
+from vyxalbot2.services.se.edits import EditStore, planEdits
+from vyxalbot2.services.se.markdown import (
+    ChatMarkdownParser,
+    UnsupportedMarkup,
+    absolutizeLink,
+    isPlainText,
+    processText,
+)
+from vyxalbot2.services.se.outbound import OutboundQueue, Priority
 from vyxalbot2.services.se.parser import CommandParser, ParseError
+from vyxalbot2.services.se.runner import CommandRunner
 from vyxalbot2.types import CommonData, EventInfo
 from vyxalbot2.util import resolveChatPFP
 
+T = TypeVar("T")
+
+PFP_CACHE_SIZE = 1000
+PFP_CACHE_TTL = 60 * 60 * 6
+
 
 class SEService(Service):
     @classmethod
@@ -42,17 +60,34 @@ class SEService(Service):
         self.reactions = reactions
         self.converter = MarkdownConverter(autolinks=False)
 
-        self.pfpCache: dict[int, str] = {}
+        self.session = ClientSession()
+        # Avatars change rarely, but they do change, so don't keep them forever
+        self.pfpCache: TTLCache[int, str] = TTLCache(PFP_CACHE_SIZE, PFP_CACHE_TTL)
+        self.pfpRequests: dict[int, Task[str]] = {}
 
         self.logger = logging.getLogger("SEService")
         self.logger.info(f"Connected to chat as user {room.userID}")
-        self.editDB: dict[int, tuple[datetime, list[int]]] = {}
+        # The ident and text of each message we sent in response to a command
+        self.editDB: EditStore[list[tuple[int, str]]] = EditStore(
+            common.publicConfig["editWindow"]
+        )
         self.parser = CommandParser(self.commands.commands)
+        self.groupOrder = list(common.publicConfig["groups"].keys())
+        self.requiredGroups: dict[str, set[str]] = {}
+        for groupName, group in common.publicConfig["groups"].items():
+            for commandName in group.get("canRun", []):
+                self.requiredGroups.setdefault(commandName, set()).add(groupName)
+        self.outbound = OutboundQueue()
+        self.runner = CommandRunner()
+        self.firstResponseTimes: deque[float] = deque(maxlen=100)
 
         self.room.register(self.onMessage, EventType.MESSAGE)
         self.room.register(self.onEdit, EventType.EDIT)
+        self.room.register(self.onDelete, EventType.DELETE)
 
     async def startup(self):
+        self.editReaper = create_task(self.editDB.reap())
+        self.outboundWorker = create_task(self.outbound.run())
         await self.room.send(
             "Well, here we are again."
             if random.random() > 0.01
@@ -60,46 +95,53 @@ class SEService(Service):
         )
 
     async def shutdown(self):
+        self.editReaper.cancel()
+        self.outboundWorker.cancel()
+        await self.session.close()
         await self.bot.shutdown()
 
+    def chat(self, priority: Priority, request: Callable[..., Awaitable[T]], *args):
+        return cast(Future[T], self.outbound.submit(priority, partial(request, *args)))
+
     async def send(self, message: str, **kwargs):
-        return await self.room.send(message)
+        return await self.chat(
+            kwargs.get("sePriority", Priority.NOTIFICATION), self.room.send, message
+        )
 
     async def pin(self, message: int):
-        await self.room.pin(message)
+        await self.chat(Priority.NOTIFICATION, self.room.pin, message)
+
+    async def fetchPFP(self, user: int):
+        async with self.session.get(
+            f"https://chat.stackexchange.com/users/thumbs/{user}"
+        ) as response:
+            return resolveChatPFP((await response.json())["email_hash"])
 
     async def getPFP(self, user: int):
-        if user not in self.pfpCache:
-            async with ClientSession() as session:
-                async with session.get(
-                    f"https://chat.stackexchange.com/users/thumbs/{user}"
-                ) as response:
-                    self.pfpCache[user] = resolveChatPFP(
-                        (await response.json())["email_hash"]
-                    )
-        return self.pfpCache[user]
+        if (pfp := self.pfpCache.get(user)) is not None:
+            return pfp
+        # Everyone asking for the same avatar at once waits on the same request
+        if user not in self.pfpRequests:
+            request = create_task(self.fetchPFP(user))
+            request.add_done_callback(lambda _: self.pfpRequests.pop(user, None))
+            self.pfpRequests[user] = request
+        pfp = await shield(self.pfpRequests[user])
+        self.pfpCache[user] = pfp
+        return pfp
 
     def preprocessMessage(self, message: str):
-        soup = BeautifulSoup(message)
+        if isPlainText(message):
+            # Most messages are plain text, which doesn't need parsing at all
+            return processText(message)
+        try:
+            return ChatMarkdownParser().convert(message)
+        except UnsupportedMarkup:
+            pass
+        soup = BeautifulSoup(message, "html.parser")
         for tag in soup.find_all("a"):
             if not isinstance(tag, Tag):
                 continue
-            url = urlparse(tag.attrs["href"])
-            if not url.netloc:
-                tag.attrs["href"] = urlunparse(
-                    (
-                        "https",
-                        "chat.stackexchange.com",
-                        url.path,
-                        url.params,
-                        url.query,
-                        url.fragment,
-                    )
-                )
-            elif not url.scheme:
-                tag.attrs["href"] = urlunparse(
-                    ("https", url.netloc, url.path, url.params, url.query, url.fragment)
-                )
+            tag.attrs["href"] = absolutizeLink(tag.attrs["href"])
         for tag in soup.find_all("img"):
             if not isinstance(tag, Tag):
                 continue
@@ -110,7 +152,7 @@ class SEService(Service):
         event = EventInfo(
             content=self.preprocessMessage(message.content),
             userName=message.user_name,
-            pfp=await self.getPFP(message.user_id),
+            pfp=partial(self.getPFP, message.user_id),
             userIdent=message.user_id,
             roomIdent=message.room_id,
             messageIdent=message.message_id,
@@ -120,12 +162,14 @@ class SEService(Service):
             return
         if message.user_id in self.common.privateConfig["chat"]["ignore"]:
             return
-        reactions = [i async for i in self.reactions.onMessage(self, event)]
-        if len(reactions):
-            await self.commandRequestSignal.send_async(self, event=event)
-            for line in reactions:
-                await self.send(line)
-                await self.commandResponseSignal.send_async(self, line=line)
+        reacted = False
+        async for line in self.reactions.onMessage(self, event):
+            if not reacted:
+                await self.commandRequestSignal.send_async(self, event=event)
+                reacted = True
+            await self.send(line, sePriority=Priority.REACTION)
+            await self.commandResponseSignal.send_async(self, line=line)
+        if reacted:
             return
         await self.messageSignal.send_async(
             self, event=event, directedAtUs=message.content.startswith("!!/")
@@ -133,30 +177,77 @@ class SEService(Service):
         if not message.content.startswith("!!/"):
             return
         await self.commandRequestSignal.send_async(self, event=event)
-        sentAt = datetime.now()
-        response = [
-            i
-            async for i in self.processMessage(
-                message.content.removeprefix("!!/"), event
+        await self.dispatch(
+            message, partial(self.runCommand, message, event, monotonic())
+        )
+
+    async def dispatch(
+        self, message: MessageEvent | EditEvent, run: Callable[[], Awaitable]
+    ):
+        if not self.runner.canRun(message.user_id):
+            await self.chat(
+                Priority.INTERACTIVE,
+                self.room.reply,
+                message.message_id,
+                "You have too many commands running already. Please wait for them to finish.",
             )
-        ]
-        if not len(response):
             return
-        responseIDs = [await self.room.reply(message.message_id, response[0])]
-        for line in response[1:]:
+        self.runner.start(
+            message.message_id,
+            message.user_id,
+            message.content.removeprefix("!!/"),
+            run,
+            partial(
+                self.chat,
+                Priority.INTERACTIVE,
+                self.room.reply,
+                message.message_id,
+                "That command took too long, so I gave up on it.",
+            ),
+        )
+
+    async def runCommand(
+        self, message: MessageEvent | EditEvent, event: EventInfo, receivedAt: float
+    ):
+        # Lines are sent as soon as the command produces them, so a command
+        # that acknowledges the user before doing something slow is seen to
+        responses: list[tuple[int, str]] = []
+        async for line in self.processMessage(
+            message.content.removeprefix("!!/"), event
+        ):
             if line == PinThat:
-                await self.room.pin(responseIDs[-1])
+                if len(responses):
+                    await self.chat(
+                        Priority.INTERACTIVE, self.room.pin, responses[-1][0]
+                    )
                 continue
-            responseIDs.append(await self.room.send(line))
-        self.editDB[message.message_id] = (sentAt, responseIDs)
-        for line in response:
+            if not len(responses):
+                responses.append(
+                    (
+                        await self.chat(
+                            Priority.INTERACTIVE,
+                            self.room.reply,
+                            message.message_id,
+                            line,
+                        ),
+                        f":{message.message_id} {line}",
+                    )
+                )
+                self.firstResponseTimes.append(monotonic() - receivedAt)
+                # Record the response straight away, so it can still be edited
+                # if the command is cancelled before it finishes
+                self.editDB.add(message.message_id, responses)
+            else:
+                responses.append(
+                    (await self.chat(Priority.INTERACTIVE, self.room.send, line), line)
+                )
             await self.commandResponseSignal.send_async(self, line=line)
 
     async def onEdit(self, room: Room, edit: EditEvent):
         event = EventInfo(
             content=edit.content,
             userName=edit.user_name,
-            pfp=await self.getPFP(edit.user_id),
+            pfp=partial(self.getPFP, edit.user_id),
             userIdent=edit.user_id,
             roomIdent=edit.room_id,
             messageIdent=edit.message_id,
@@ -170,36 +261,52 @@ class SEService(Service):
         if not edit.content.startswith("!!/"):
             return
         await self.commandRequestSignal.send_async(self, event=event)
-        if edit.message_id not in self.editDB:
+        # Whatever the old version of the command was doing is moot now
+        self.runner.cancel(edit.message_id)
+        if (responses := self.editDB.get(edit.message_id)) is None:
             with self.messageSignal.muted(), self.commandRequestSignal.muted():
                 await self.onMessage(room, edit)
         else:
-            sentAt, idents = self.editDB[edit.message_id]
-            if (datetime.now() - sentAt).seconds > (60 * 2):  # margin of error
-                with self.messageSignal.muted(), self.commandRequestSignal.muted():
-                    await self.onMessage(room, edit)
-            else:
-                response = [
-                    i
-                    async for i in self.processMessage(
-                        self.preprocessMessage(edit.content.removeprefix("!!/")), event
-                    )
-                ]
-                for line in response:
-                    await self.commandResponseSignal.send_async(line=line)
-                if len(response):
-                    response[0] = f":{edit.message_id} " + response[0]
-                for x in range(min(len(idents), len(response))):
-                    await self.room.edit(idents.pop(0), response.pop(0))
-                for leftover in response:
-                    await self.room.send(leftover)
-                for leftover in idents:
-                    await self.room.delete(leftover)
-                self.editDB.pop(edit.message_id)
-        # we always check the DB regardless of how we responded
-        for key, value in self.editDB.copy().items():
-            if (datetime.now() - value[0]).seconds > (60 * 2):
-                self.editDB.pop(key)
+            await self.dispatch(
+                edit, partial(self.rerunCommand, edit, event, responses)
+            )
+
+    async def rerunCommand(
+        self, edit: EditEvent, event: EventInfo, responses: list[tuple[int, str]]
+    ):
+        lines: list[str] = []
+        async for line in self.processMessage(
+            self.preprocessMessage(edit.content.removeprefix("!!/")), event
+        ):
+            # Whatever was pinned the first time round stays pinned
+            if line == PinThat:
+                continue
+            lines.append(line)
+            await self.commandResponseSignal.send_async(self, line=line)
+        if len(lines):
+            lines[0] = f":{edit.message_id} " + lines[0]
+        # Only touch the messages that need to change. responses is updated as
+        # we go, so it always matches what's in the room, even if this is
+        # cancelled partway through by another edit.
+        edits, sends, deletes = planEdits([text for _, text in responses], lines)
+        for old, new in edits.items():
+            await self.chat(
+                Priority.INTERACTIVE, self.room.edit, responses[old][0], lines[new]
+            )
+            responses[old] = (responses[old][0], lines[new])
+        for old in reversed(deletes):
+            await self.chat(Priority.INTERACTIVE, self.room.delete, responses[old][0])
+            responses.pop(old)
+        for new in sends:
+            responses.append(
+                (
+                    await self.chat(Priority.INTERACTIVE, self.room.send, lines[new]),
+                    lines[new],
+                )
+            )
+
+    async def onDelete(self, room: Room, delete: DeleteEvent):
+        self.runner.cancel(delete.message_id)
 
     async def processMessage(self, message: str, event: EventInfo):
         try:
@@ -207,16 +314,14 @@ class SEService(Service):
         except ParseError as e:
             yield "Command error: " + e.message
             return
-        userInfo = await self.common.userDB.getUser(self, event.userIdent)
-        for groupName, group in self.common.publicConfig["groups"].items():
-            if commandName in group.get("canRun", []):
-                if userInfo is not None:
-                    if groupName not in userInfo.groups:
-                        yield f"Only members of group {groupName} can run !!/{commandName}."
-                        return
-                else:
-                    yield f"Only members of group {groupName} can run !!/{commandName}."
-                    return
+        if requiredGroups := self.requiredGroups.get(commandName):
+            # Only look the user up for commands that are actually restricted
+            userInfo = await self.common.userDB.getUser(self, event.userIdent)
+            userGroups = set(userInfo.groups) if userInfo is not None else set()
+            if missing := requiredGroups - userGroups:
+                groupName = next(i for i in self.groupOrder if i in missing)
+                yield f"Only members of group {groupName} can run !!/{commandName}."
+                return
         try:
             async for l in impl(event, *args):
                 yield l
@@ -0,0 +1,99 @@
+from asyncio import sleep
+from collections import OrderedDict
+from time import monotonic
+from typing import Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class EditStore(Generic[T]):
+    # Remembers what we sent in response to a message, for as long as edits to
+    # that message should update our responses. Every entry lives for the same
+    # window, so insertion order is also expiry order and expiring is just
+    # popping from the front.
+    def __init__(self, window: float, maxSize: int = 1000):
+        self.window = window
+        self.maxSize = maxSize
+        self.entries: OrderedDict[int, tuple[float, T]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, ident: int, value: T):
+        self.entries.pop(ident, None)
+        self.entries[ident] = (monotonic(), value)
+        self.expire()
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, ident: int) -> Optional[T]:
+        entry = self.entries.get(ident)
+        if entry is None or monotonic() - entry[0] > self.window:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def pop(self, ident: int):
+        self.entries.pop(ident, None)
+
+    def expire(self):
+        now = monotonic()
+        while len(self.entries):
+            ident, (addedAt, _) = next(iter(self.entries.items()))
+            if now - addedAt <= self.window:
+                break
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def reap(self):
+        while True:
+            await sleep(self.window)
+            self.expire()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def planEdits(old: list[str], new: list[str]):
+    # Works out the fewest chat requests that turn the messages we sent (old)
+    # into new. Chat can't insert a message between two others, so the result
+    # is always some of the old messages, each edited if it needs to be,
+    # followed by freshly sent ones. Returns (edits, sends, deletes), where
+    # edits maps indices into old to indices into new and only includes
+    # messages whose text actually changes.
+    # cost[i][j] is the cheapest way to turn old[:i] into new[:j], if j <= i
+    cost = [[0] * (len(new) + 1) for _ in range(len(old) + 1)]
+    for i in range(1, len(old) + 1):
+        for j in range(min(i, len(new)) + 1):
+            cost[i][j] = cost[i - 1][j] + 1 if j < i else len(old) + len(new)
+            if j:
+                cost[i][j] = min(
+                    cost[i][j], cost[i - 1][j - 1] + (old[i - 1] != new[j - 1])
+                )
+    kept = min(
+        range(min(len(old), len(new)) + 1),
+        key=lambda j: (cost[len(old)][j] + len(new) - j, -j),
+    )
+    edits: dict[int, int] = {}
+    deletes: list[int] = []
+    i, j = len(old), kept
+    while i:
+        if j and cost[i][j] == cost[i - 1][j - 1] + (old[i - 1] != new[j - 1]):
+            if old[i - 1] != new[j - 1]:
+                edits[i - 1] = j - 1
+            j -= 1
+        else:
+            deletes.append(i - 1)
+        i -= 1
+    return dict(reversed(edits.items())), list(range(kept, len(new))), deletes[::-1]
@@ -0,0 +1,143 @@
+from html.parser import HTMLParser
+from urllib.parse import urlparse, urlunparse
+
+import re
+
+WHITESPACE_REGEX = re.compile(r"[\t ]+")
+# BeautifulSoup and HTMLParser disagree on malformed entities and on line breaks,
+# so only the entities chat actually sends are handled without falling back
+UNUSUAL_CONTENT_REGEX = re.compile(r"&(?!(?:amp|lt|gt|quot|#39);)|[\r\n]")
+# Inline tags we know how to convert, and the markup they turn into
+INLINE_MARKUP = {"b": "**", "i": "*", "code": "`", "strike": ""}
+
+
+class UnsupportedMarkup(Exception):
+    pass
+
+
+def absolutizeLink(href: str):
+    url = urlparse(href)
+    if not url.netloc:
+        return urlunparse(
+            (
+                "https",
+                "chat.stackexchange.com",
+                url.path,
+                url.params,
+                url.query,
+                url.fragment,
+            )
+        )
+    elif not url.scheme:
+        return urlunparse(
+            ("https", url.netloc, url.path, url.params, url.query, url.fragment)
+        )
+    return href
+
+
+def isPlainText(message: str):
+    return not any(char in message for char in "<&\r\n")
+
+
+def processText(text: str, escape: bool = True):
+    text = WHITESPACE_REGEX.sub(" ", text)
+    if escape:
+        text = text.replace("*", r"\*").replace("_", r"\_")
+    return text
+
+
+def chomp(text: str):
+    prefix = " " if text and text[0] == " " else ""
+    suffix = " " if text and text[-1] == " " else ""
+    return prefix, suffix, text.strip()
+
+
+class ChatMarkdownParser(HTMLParser):
+    # Converts the small subset of HTML that chat messages are usually made of
+    # in one pass, producing the same output as MarkdownConverter would. Any
+    # markup outside of that subset raises UnsupportedMarkup, so the caller
+    # can fall back to the full converter.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output: list[str] = []
+        self.openTag: tuple[str, dict[str, str | None]] | None = None
+        self.tagText: list[str] = []
+        self.seenImage = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if self.openTag is not None:
+            raise UnsupportedMarkup
+        if tag == "img":
+            src = dict(attrs).get("src")
+            # Replacing several images in one soup loses text around them, and
+            # we'd rather keep doing whatever the full converter does there
+            if src is None or self.seenImage:
+                raise UnsupportedMarkup
+            self.seenImage = True
+            # Images are replaced with their source, which is then treated like any other text
+            self.output.append(processText(src))
+        elif tag == "a":
+            if dict(attrs).get("href") is None:
+                raise UnsupportedMarkup
+            self.openTag = tag, dict(attrs)
+        elif tag in INLINE_MARKUP:
+            self.openTag = tag, dict(attrs)
+        else:
+            raise UnsupportedMarkup
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        if tag != "img":
+            raise UnsupportedMarkup
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str):
+        if tag == "img":
+            return
+        if self.openTag is None or self.openTag[0] != tag:
+            raise UnsupportedMarkup
+        attrs = self.openTag[1]
+        self.openTag = None
+        text = "".join(self.tagText)
+        self.tagText.clear()
+        if tag == "strike":
+            # There's no Markdown for this in chat, so only the text is kept
+            self.output.append(text)
+            return
+        prefix, suffix, text = chomp(text)
+        if not text:
+            return
+        if tag == "a":
+            href = absolutizeLink(attrs["href"] or "")
+            title = attrs.get("title")
+            titlePart = ' "%s"' % title.replace('"', r"\"") if title else ""
+            self.output.append(f"{prefix}[{text}]({href}{titlePart}){suffix}")
+        else:
+            markup = INLINE_MARKUP[tag]
+            self.output.append(f"{prefix}{markup}{text}{markup}{suffix}")
+
+    def handle_data(self, data: str):
+        if self.openTag is None:
+            self.output.append(processText(data))
+        else:
+            self.tagText.append(processText(data, self.openTag[0] != "code"))
+
+    def handle_comment(self, data: str):
+        raise UnsupportedMarkup
+
+    def handle_decl(self, decl: str):
+        raise UnsupportedMarkup
+
+    def handle_pi(self, data: str):
+        raise UnsupportedMarkup
+
+    def unknown_decl(self, data: str):
+        raise UnsupportedMarkup
+
+    def convert(self, message: str):
+        if UNUSUAL_CONTENT_REGEX.search(message) is not None:
+            raise UnsupportedMarkup
+        self.feed(message)
+        self.close()
+        if self.openTag is not None:
+            raise UnsupportedMarkup
+        return "".join(self.output)
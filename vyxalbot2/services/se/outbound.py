@@ -0,0 +1,105 @@
+from asyncio import Event, Future, get_running_loop, sleep
+from enum import IntEnum
+from heapq import heappop, heappush
+from itertools import count
+from time import monotonic
+from typing import Any, Awaitable, Callable
+
+import logging
+import re
+
+THROTTLE_REGEX = re.compile(r"again in (?P<seconds>\d+) seconds?")
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    REACTION = 2
+
+
+class OutboundQueue:
+    # Everything we do to the room goes through here one request at a time, so
+    # replies to commands can skip ahead of webhook notifications and fun
+    # reactions instead of fighting them for chat's rate limit. Requests of the
+    # same priority are run in the order they were submitted.
+    def __init__(
+        self, minInterval: float = 0.0, maxInterval: float = 10.0, maxRetries: int = 3
+    ):
+        self.logger = logging.getLogger("OutboundQueue")
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.maxRetries = maxRetries
+        self.interval = minInterval
+
+        self.queue: list[
+            tuple[Priority, int, float, Callable[[], Awaitable[Any]], Future]
+        ] = []
+        self.order = count()
+        self.pending = Event()
+
+        self.sent = {priority: 0 for priority in Priority}
+        self.totalWait = {priority: 0.0 for priority in Priority}
+        self.maxWait = {priority: 0.0 for priority in Priority}
+        self.throttles = 0
+
+    def submit(self, priority: Priority, request: Callable[[], Awaitable[Any]]):
+        future = get_running_loop().create_future()
+        heappush(self.queue, (priority, next(self.order), monotonic(), request, future))
+        self.pending.set()
+        return future
+
+    def throttled(self, error: Exception):
+        if (match := THROTTLE_REGEX.search(str(error))) is None:
+            return None
+        return float(match.group("seconds"))
+
+    async def perform(self, request: Callable[[], Awaitable[Any]]):
+        for _ in range(self.maxRetries):
+            try:
+                result = await request()
+            except Exception as e:
+                if (delay := self.throttled(e)) is None:
+                    raise
+                self.throttles += 1
+                # Chat told us to slow down, so space everything out more from now on
+                self.interval = min(self.maxInterval, max(delay, self.interval * 2, 1))
+                self.logger.warning(f"Throttled by chat, waiting {delay} seconds")
+                await sleep(delay)
+            else:
+                self.interval = max(self.minInterval, self.interval * 0.75)
+                return result
+        return await request()
+
+    async def run(self):
+        while True:
+            if not len(self.queue):
+                self.pending.clear()
+                await self.pending.wait()
+            priority, _, submittedAt, request, future = heappop(self.queue)
+            if future.cancelled():
+                continue
+            wait = monotonic() - submittedAt
+            self.sent[priority] += 1
+            self.totalWait[priority] += wait
+            self.maxWait[priority] = max(self.maxWait[priority], wait)
+            try:
+                future.set_result(await self.perform(request))
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            await sleep(self.interval)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "throttles": self.throttles,
+            "depth": {
+                priority.name: sum(1 for i in self.queue if i[0] == priority)
+                for priority in Priority
+            },
+            "averageWait": {
+                priority.name: self.totalWait[priority] / max(1, self.sent[priority])
+                for priority in Priority
+            },
+            "maxWait": {priority.name: self.maxWait[priority] for priority in Priority},
+        }
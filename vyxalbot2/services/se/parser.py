@@ -1,16 +1,7 @@
 from enum import Enum, auto
 from string import digits, ascii_letters
-from inspect import signature
 
-from vyxalbot2.commands import Command
-
-
-class ParseState(Enum):
-    TOPLEVEL = auto()
-    FLAG = auto()
-    STRING = auto()
-    NUMBER = auto()
-    STRARRAY = auto()
+from vyxalbot2.commands import Command, CommandParameter
 
 
 class TokenType(Enum):
@@ -36,118 +27,215 @@ class ParseError(Exception):
         self.message = message
 
 
+def editDistance(one: str, other: str):
+    previous = list(range(len(other) + 1))
+    for x, oneChar in enumerate(one, 1):
+        current = [x]
+        for y, otherChar in enumerate(other, 1):
+            current.append(
+                min(
+                    previous[y] + 1,
+                    current[y - 1] + 1,
+                    previous[y - 1] + (oneChar != otherChar),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class CommandTrie:
+    # A character-level trie over command names. Every node also remembers the
+    # names below it, so listing the subcommands of a prefix is a single walk.
+    def __init__(self, names: list[str]):
+        self.root = self.newNode()
+        for name in names:
+            node = self.root
+            node["below"].append(name)
+            for char in name:
+                node = node["children"].setdefault(char, self.newNode())
+                node["below"].append(name)
+            node["name"] = name
+
+    def newNode(self):
+        return {"children": {}, "below": [], "name": None}
+
+    def walk(self, node: dict | None, text: str):
+        for char in text:
+            if node is None:
+                return None
+            node = node["children"].get(char)
+        return node
+
+    def resolve(self, words: list[str]):
+        """Find the longest command made of the leading words. Returns the name and how many words it used."""
+        node = self.root
+        found = None, 0
+        for index, word in enumerate(words):
+            node = self.walk(node, (" " if index else "") + word)
+            if node is None:
+                break
+            if node["name"] is not None:
+                found = node["name"], index + 1
+        return found
+
+    def withPrefix(self, prefix: str) -> list[str]:
+        node = self.walk(self.root, prefix)
+        if node is None:
+            return []
+        return node["below"]
+
+
+class SuggestionIndex:
+    # A BK-tree keyed on edit distance, so looking up near misses only visits
+    # the parts of the tree that can be within range of the query
+    def __init__(self, names: list[str]):
+        self.order = {name: index for index, name in enumerate(names)}
+        self.root: tuple[str, dict] | None = None
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        if self.root is None:
+            self.root = (name, {})
+            return
+        node = self.root
+        while True:
+            distance = editDistance(name, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (name, {})
+                return
+            node = node[1][distance]
+
+    def search(self, query: str, maxDistance: int):
+        found: dict[str, int] = {}
+        if self.root is None:
+            return found
+        pending = [self.root]
+        while len(pending):
+            name, children = pending.pop()
+            distance = editDistance(query, name)
+            if distance <= maxDistance:
+                found[name] = distance
+            for childDistance, child in children.items():
+                if abs(childDistance - distance) <= maxDistance:
+                    pending.append(child)
+        return found
+
+    def suggest(self, queries: list[str], limit: int = 3):
+        found: dict[str, int] = {}
+        for query in queries:
+            # Short names are only a couple of edits away from each other
+            maxDistance = min(2, max(1, len(query) // 3))
+            for name, distance in self.search(query, maxDistance).items():
+                found[name] = min(distance, found.get(name, distance))
+        return sorted(found, key=lambda name: (found[name], self.order[name]))[:limit]
+
+
 class CommandParser:
     def __init__(self, commands: dict[str, Command]):
         self.commands = commands
+        self.trie = CommandTrie(list(commands.keys()))
+        self.suggestions = SuggestionIndex(list(commands.keys()))
+        self.maxNameWords = max(
+            (len(name.split(" ")) for name in commands.keys()), default=1
+        )
+        self.schemas = {
+            name: self.genSchema(command) for name, command in commands.items()
+        }
+
+    def genSchema(self, command: Command):
+        schema: list[tuple[CommandParameter, TokenType]] = []
+        for param in command.parameters:
+            if param.enumValues is not None:
+                schema.append((param, TokenType.FLAG))
+            else:
+                schema.append((param, TYPES_TO_TOKENS[param.annotation]))
+        return schema
 
     def parseArgs(self, args: str):
-        charStack = list(args)
-        stack = []
-        state = ParseState.TOPLEVEL
-        while True:
-            match state:
-                case ParseState.TOPLEVEL:
-                    try:
-                        char = charStack.pop(0)
-                    except IndexError:
-                        return
-                    if char in ascii_letters:
-                        state = ParseState.FLAG
+        # Walks the input by index rather than popping characters off the front
+        # of a list, so tokenizing stays linear in the length of the message
+        length = len(args)
+        index = 0
+        while index < length:
+            char = args[index]
+            index += 1
+            if char in ascii_letters:
+                end = args.find(" ", index)
+                if end == -1:
+                    end = length
+                yield TokenType.FLAG, char + args[index:end]
+                index = end + 1
+            elif char in digits:
+                stack = [char]
+                while index < length:
+                    char = args[index]
+                    index += 1
+                    if char in digits:
                         stack.append(char)
-                    elif char in digits:
-                        state = ParseState.NUMBER
+                    elif char == ".":
                         stack.append(char)
-                    elif char == '"':
-                        state = ParseState.STRING
-                    elif char == "[":
-                        state = ParseState.STRARRAY
-                        stack.append([])
+                        if index >= length:
+                            yield TokenType.ERROR, "Expected digit after period"
+                            return
+                        stack.append(args[index])
+                        index += 1
                     elif char == " ":
-                        pass
+                        break
                     else:
-                        yield TokenType.ERROR, f"Unexpected toplevel character {char}"
+                        yield TokenType.ERROR, "Expected digit or period"
                         return
-                case ParseState.FLAG:
-                    try:
-                        char = charStack.pop(0)
-                    except IndexError:
-                        char = " "
-                    if char == " ":
-                        yield TokenType.FLAG, "".join(stack)
-                        stack.clear()
-                        state = ParseState.TOPLEVEL
-                    else:
-                        stack.append(char)
-                case ParseState.STRING:
-                    try:
-                        char = charStack.pop(0)
-                    except IndexError:
+                if "." in stack:
+                    yield TokenType.FLOAT, float("".join(stack))
+                else:
+                    yield TokenType.INT, int("".join(stack))
+            elif char == '"':
+                stack = []
+                while True:
+                    if index >= length:
                         yield TokenType.ERROR, "Unclosed string"
                         return
+                    char = args[index]
+                    index += 1
                     if char == "\\":
-                        try:
-                            stack.append(charStack.pop(0))
-                        except IndexError:
+                        if index >= length:
                             yield TokenType.ERROR, "Expected character to escape"
                             return
+                        stack.append(args[index])
+                        index += 1
                     elif char == '"':
-                        yield TokenType.STRING, "".join(stack)
-                        stack.clear()
-                        state = ParseState.TOPLEVEL
+                        break
                     else:
                         stack.append(char)
-                case ParseState.NUMBER:
-                    try:
-                        char = charStack.pop(0)
-                    except IndexError:
-                        char = None
-                    else:
-                        if char in digits:
-                            stack.append(char)
-                        elif char == ".":
-                            stack.append(char)
-                            try:
-                                stack.append(charStack.pop(0))
-                            except IndexError:
-                                yield TokenType.ERROR, "Expected digit after period"
-                                return
-                        elif char == " ":
-                            char = None
-                        else:
-                            yield TokenType.ERROR, "Expected digit or period"
-                            return
-                    if char == None:
-                        if "." in stack:
-                            yield TokenType.FLOAT, float("".join(stack))
-                        else:
-                            yield TokenType.INT, int("".join(stack))
-                        stack.clear()
-                        state = ParseState.TOPLEVEL
-                case ParseState.STRARRAY:
-                    while True:
-                        try:
-                            char = charStack.pop(0)
-                        except IndexError:
-                            yield TokenType.ERROR, "Unclosed strarray"
+                yield TokenType.STRING, "".join(stack)
+            elif char == "[":
+                items = [[]]
+                while True:
+                    if index >= length:
+                        yield TokenType.ERROR, "Unclosed strarray"
+                        return
+                    char = args[index]
+                    index += 1
+                    if char == "\\":
+                        if index >= length:
+                            yield TokenType.ERROR, "Expected character to escape"
                             return
-                        if char == "\\":
-                            try:
-                                stack[-1].append(charStack.pop(0))
-                            except IndexError:
-                                yield TokenType.ERROR, "Expected character to escape"
-                                return
-                        elif char == ",":
-                            stack.append([])
-                            break
-                        elif char == "]":
-                            yield TokenType.STRARRAY, [
-                                "".join(i) for i in stack if len(i)
-                            ]
-                            stack.clear()
-                            state = ParseState.TOPLEVEL
-                            break
-                        else:
-                            stack[-1].append(char)
+                        items[-1].append(args[index])
+                        index += 1
+                    elif char == ",":
+                        items.append([])
+                    elif char == "]":
+                        break
+                    else:
+                        items[-1].append(char)
+                yield TokenType.STRARRAY, ["".join(i) for i in items if len(i)]
+            elif char == " ":
+                pass
+            else:
+                yield TokenType.ERROR, f"Unexpected toplevel character {char}"
+                return
 
     def parseCommand(self, command: str):
         args = list(self.parseArgs(command))
@@ -158,38 +246,37 @@ class CommandParser:
         if ty != TokenType.FLAG:
             raise ParseError(f"Expected command name, got {ty.name}")
         assert isinstance(commandName, str)
-        if commandName not in self.commands:
-            while len(args) and args[0][0] == TokenType.FLAG:
-                assert isinstance((i := args.pop(0)[1]), str)
-                commandName += " " + i
-                if commandName in self.commands:
-                    break
-        try:
-            impl = self.commands[commandName].impl
-        except KeyError:
-            maybeYouMeant = []
-            for command in self.commands.keys():
-                if command.startswith(commandName.split(" ")[0]):
-                    maybeYouMeant.append(command)
+        words = [commandName]
+        for argType, argValue in args[: self.maxNameWords - 1]:
+            if argType != TokenType.FLAG:
+                break
+            assert isinstance(argValue, str)
+            words.append(argValue)
+        commandName, length = self.trie.resolve(words)
+        if commandName is None:
+            maybeYouMeant = self.trie.withPrefix(words[0])
             if len(maybeYouMeant):
                 raise ParseError(
-                    f"Unknown command. Perhaps you forgot some quotes? Valid subcommands of {commandName.split(' ')[0]} are: "
+                    f"Unknown command. Perhaps you forgot some quotes? Valid subcommands of {words[0]} are: "
                     + ", ".join(maybeYouMeant)
                 )
-            raise ParseError("Unknown command.") from None
+            suggestions = self.suggestions.suggest(
+                [" ".join(words[: i + 1]) for i in range(len(words))]
+            )
+            if len(suggestions):
+                raise ParseError(
+                    f"Unknown command. Did you mean: {', '.join(suggestions)}?"
+                )
+            raise ParseError("Unknown command.")
+        del args[: length - 1]
+        impl = self.commands[commandName].impl
         argValues = []
-        for paramName, param in signature(impl).parameters.items():
-            if paramName in ("event", "self"):
-                continue
-            if issubclass(param.annotation, Enum):
-                paramType = TokenType.FLAG
-            else:
-                paramType = TYPES_TO_TOKENS[param.annotation]
+        for param, paramType in self.schemas[commandName]:
             try:
                 argType, argValue = args.pop(0)
             except IndexError:
-                if param.default is param.empty:
-                    raise ParseError(f"Expected a value for {paramName}")
+                if param.required:
+                    raise ParseError(f"Expected a value for {param.name}")
                 else:
                     argValues.append(param.default)
             else:
@@ -197,15 +284,15 @@ class CommandParser:
                     raise ParseError(str(argValue))
                 if argType != paramType:
                     raise ParseError(
-                        f"Expected {paramType.name} for {paramName} but got {argType.name}"
+                        f"Expected {paramType.name} for {param.name} but got {argType.name}"
                     )
                 if argType == TokenType.FLAG:
-                    assert issubclass(param.annotation, Enum)
+                    assert param.enumValues is not None
                     try:
-                        argValues.append(param.annotation(argValue))
-                    except ValueError:
+                        argValues.append(param.enumValues[argValue])
+                    except KeyError:
                         raise ParseError(
-                            f"Invalid value for {paramName}! Expected one of: {', '.join(member.value for member in param.annotation)}"
+                            f"Invalid value for {param.name}! Expected one of: {', '.join(param.enumValues.keys())}"
                         )
                 else:
                     argValues.append(argValue)
@@ -0,0 +1,93 @@
+from asyncio import Semaphore, Task, create_task, timeout
+from collections import Counter
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Awaitable, Callable
+
+import logging
+
+
+@dataclass
+class RunningCommand:
+    command: str
+    userIdent: int
+    task: Task | None = None
+    queuedAt: float = field(default_factory=monotonic)
+    startedAt: float | None = None
+
+
+class CommandRunner:
+    # Runs commands in the background so a slow one doesn't hold up every
+    # message after it. At most maxWorkers commands run at once (the rest wait
+    # their turn), each user may only have perUser commands in flight, and
+    # anything still running after the deadline is cancelled.
+    def __init__(self, maxWorkers: int = 4, perUser: int = 2, deadline: float = 60):
+        self.logger = logging.getLogger("CommandRunner")
+        self.slots = Semaphore(maxWorkers)
+        self.perUser = perUser
+        self.deadline = deadline
+        self.running: dict[int, RunningCommand] = {}
+        self.userCounts: Counter[int] = Counter()
+
+    def canRun(self, userIdent: int):
+        return self.userCounts[userIdent] < self.perUser
+
+    def start(
+        self,
+        messageIdent: int,
+        userIdent: int,
+        command: str,
+        run: Callable[[], Awaitable],
+        onTimeout: Callable[[], Awaitable],
+    ):
+        self.cancel(messageIdent)
+        running = RunningCommand(command, userIdent)
+        running.task = create_task(self.run(running, run, onTimeout))
+        running.task.add_done_callback(lambda task: self.forget(messageIdent, task))
+        self.running[messageIdent] = running
+        self.userCounts[userIdent] += 1
+
+    async def run(
+        self,
+        running: RunningCommand,
+        run: Callable[[], Awaitable],
+        onTimeout: Callable[[], Awaitable],
+    ):
+        async with self.slots:
+            running.startedAt = monotonic()
+            try:
+                async with timeout(self.deadline):
+                    await run()
+            except TimeoutError:
+                self.logger.warning(f"{running.command} timed out")
+                await onTimeout()
+            except Exception:
+                self.logger.exception(
+                    f"An exception occured whilst running {running.command}:"
+                )
+
+    def forget(self, messageIdent: int, task: Task | None = None):
+        running = self.running.get(messageIdent)
+        # The command may have been replaced by a rerun since this task started
+        if running is None or (task is not None and running.task is not task):
+            return None
+        self.running.pop(messageIdent)
+        self.userCounts[running.userIdent] -= 1
+        if not self.userCounts[running.userIdent]:
+            self.userCounts.pop(running.userIdent)
+        return running
+
+    def cancel(self, messageIdent: int):
+        if (running := self.forget(messageIdent)) is None:
+            return False
+        assert running.task is not None
+        running.task.cancel()
+        return True
+
+    def status(self):
+        now = monotonic()
+        for messageIdent, running in self.running.items():
+            if running.startedAt is None:
+                yield messageIdent, running.command, "queued", now - running.queuedAt
+            else:
+                yield messageIdent, running.command, "running", now - running.startedAt
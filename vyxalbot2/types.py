@@ -1,4 +1,12 @@
-from typing import Any, AsyncGenerator, Callable, TypedDict, TYPE_CHECKING
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    NotRequired,
+    TypedDict,
+    TYPE_CHECKING,
+)
 from datetime import datetime
 from dataclasses import dataclass
 
@@ -8,6 +16,8 @@ if TYPE_CHECKING:
     from vyxalbot2.userdb import UserDB
 
 CommandImpl = Callable[..., AsyncGenerator[Any, None]]
+# Resolving an avatar can take a network request, so it's only done when asked for
+PFPResolver = Callable[[], Awaitable[str]]
 
 
 class GroupType(TypedDict, total=False):
@@ -45,10 +55,16 @@ class PrivateConfigType(TypedDict):
     appID: str
     pem: str
     webhookSecret: str
+    # Where webhook deliveries wait to be handled
+    deliveryQueuePath: NotRequired[str]
     tyxalInstance: str
 
+    # Either "mongo" (the default), which uses mongoUrl and database, or
+    # "sqlite", which keeps users in a local file at sqlitePath
+    userStore: NotRequired[str]
     mongoUrl: str
     database: str
+    sqlitePath: NotRequired[str]
 
     chat: ChatConfigType
     discord: DiscordConfigType
@@ -76,6 +92,11 @@ class PublicConfigType(TypedDict):
     production: dict[str, ProductionType]
     autotag: dict[str, AutotagType]
     requiredLabels: dict[str, RequiredLabelsType]
+    # How long, in seconds, edits to a command update our responses to it
+    editWindow: int
+    # How long, in seconds, to gather bursts of each kind of GitHub event into
+    # one message, by repository name or "*" for the default
+    coalesce: NotRequired[dict[str, dict[str, float]]]
 
 
 class MessagesType(TypedDict):
@@ -110,7 +131,7 @@ class CommonData:
 class EventInfo:
     content: str
     userName: str
-    pfp: str
+    pfp: PFPResolver
     roomIdent: int
     userIdent: int
     messageIdent: int
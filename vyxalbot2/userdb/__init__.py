@@ -0,0 +1,316 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Hashable, Optional
+
+import logging
+
+from blinker import Signal
+from odmantic import Model, ObjectId
+
+from vyxalbot2.services import Service
+
+
+def normalizeName(name: str):
+    # Chat pings ignore case and spaces, so people type names the same way
+    return "".join(name.split()).lstrip("@").casefold()
+
+
+class User(Model):
+    service: str
+    serviceIdent: int
+    name: str
+    # normalizeName(name), kept up to date by UserDB so it can be indexed
+    normalizedName: str = ""
+    pfp: str
+    groups: list[str] = []
+    linked: dict[str, ObjectId] = {}
+    bonusData: dict[str, str] = {}
+
+
+class UserCache:
+    # Keeps recently used users in memory, by (service, ident) with a secondary
+    # index by name, plus the results of linked account queries.
+    # Users that don't exist are cached too, since most people who talk to the
+    # bot never register.
+    def __init__(self, maxSize: int):
+        self.maxSize = maxSize
+        self.users: OrderedDict[tuple[str, int], Optional[User]] = OrderedDict()
+        self.names: dict[tuple[str, str], tuple[str, int]] = {}
+        # Users are mutated in place before they're saved, so remember which
+        # name each one was indexed under rather than trusting user.name
+        self.indexedNames: dict[tuple[str, int], tuple[str, str]] = {}
+        # Bounded like users, since there's one per user whose links we looked up
+        self.queries: OrderedDict[Hashable, list[User]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[str, int]) -> tuple[bool, Optional[User]]:
+        if key not in self.users:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.users.move_to_end(key)
+        return True, self.users[key]
+
+    def getByName(self, service: str, name: str):
+        # Indexed by exact name, since several users can share a normalized
+        # one and which of them a lookup gets is up to the store
+        if (key := self.names.get((service, name))) is None:
+            self.misses += 1
+            return None
+        return self.get(key)[1]
+
+    def forget(self, key: tuple[str, int]):
+        self.users.pop(key, None)
+        if (name := self.indexedNames.pop(key, None)) is not None:
+            if self.names.get(name) == key:
+                self.names.pop(name)
+
+    def put(self, key: tuple[str, int], user: Optional[User]):
+        self.forget(key)
+        self.users[key] = user
+        if user is not None:
+            name = (user.service, user.name)
+            self.names[name] = key
+            self.indexedNames[key] = name
+        while len(self.users) > self.maxSize:
+            self.forget(next(iter(self.users)))
+            self.evictions += 1
+
+    def getQuery(self, query: Hashable):
+        if query not in self.queries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.queries.move_to_end(query)
+        return self.queries[query]
+
+    def putQuery(self, query: Hashable, users: list[User]):
+        self.queries.pop(query, None)
+        self.queries[query] = users
+        while len(self.queries) > self.maxSize:
+            self.queries.popitem(last=False)
+            self.evictions += 1
+        for user in users:
+            self.put((user.service, user.serviceIdent), user)
+
+    def invalidateQueries(self):
+        self.queries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / max(1, self.hits + self.misses),
+            "evictions": self.evictions,
+        }
+
+
+class UserStore(ABC):
+    # Where users actually live. UserDB does caching and change notification on
+    # top of this, so a store only has to answer queries and apply writes.
+    async def setup(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def find(self, service: str, ident: int) -> Optional[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def findByName(self, service: str, normalizedName: str) -> list[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def findByNamePrefix(
+        self, service: str, prefix: str, limit: int
+    ) -> list[User]:
+        # Matches on normalizedName, in order of it
+        raise NotImplementedError
+
+    @abstractmethod
+    async def findByIds(self, ids: list[ObjectId]) -> list[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def identsInGroup(self, service: str, group: str) -> AsyncIterator[tuple[int, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def sampleName(self, service: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert(self, user: User) -> bool:
+        # Returns False if there's already a user with that service and ident
+        raise NotImplementedError
+
+    @abstractmethod
+    async def updateDetails(
+        self, service: str, ident: int, name: str, pfp: str
+    ) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def addToGroup(self, user: User, group: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def removeFromGroup(self, user: User, group: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def replace(self, users: list[User]):
+        raise NotImplementedError
+
+
+class UserDB:
+    userModify = Signal()
+
+    def __init__(self, store: UserStore, cacheSize: Optional[int] = 5000):
+        self.logger = logging.getLogger("UserDB")
+        self.store = store
+        self.cache = UserCache(cacheSize) if cacheSize else None
+        self.userModify.connect(self.onUserModify)
+
+    async def setup(self):
+        await self.store.setup()
+
+    async def close(self):
+        await self.store.close()
+
+    async def onUserModify(self, sender: Any, **kwargs):
+        # Any change can move users in or out of a query's results
+        if self.cache is not None:
+            self.cache.invalidateQueries()
+
+    async def getUser(self, service: Service, ident: int) -> Optional[User]:
+        if self.cache is not None:
+            found, user = self.cache.get((service.name, ident))
+            if found:
+                return user
+        user = await self.store.find(service.name, ident)
+        if self.cache is not None:
+            self.cache.put((service.name, ident), user)
+        return user
+
+    async def randomUser(self, service: Service) -> Optional[str]:
+        # Only the name is needed, so don't load the whole table to pick one
+        return await self.store.sampleName(service.name)
+
+    async def getUserByName(self, service: Service, name: str) -> Optional[User]:
+        if self.cache is not None:
+            if (user := self.cache.getByName(service.name, name)) is not None:
+                return user
+        users = await self.store.findByName(service.name, normalizeName(name))
+        if not len(users):
+            return None
+        # Two users can only differ by case or spacing; prefer the exact match
+        user = next((i for i in users if i.name == name), users[0])
+        if self.cache is not None:
+            self.cache.put((user.service, user.serviceIdent), user)
+        return user
+
+    async def searchUsers(self, service: Service, prefix: str, limit: int = 10):
+        # For suggesting names, so this always goes to the store
+        return await self.store.findByNamePrefix(
+            service.name, normalizeName(prefix), limit
+        )
+
+    async def createUser(self, service: Service, ident: int, name: str, pfp: str):
+        user = User(
+            service=service.name,
+            serviceIdent=ident,
+            name=name,
+            normalizedName=normalizeName(name),
+            pfp=pfp,
+        )
+        if not await self.store.insert(user):
+            if self.cache is not None:
+                self.cache.forget((service.name, ident))
+            raise ValueError("User exists")
+        await self.modified(user)
+
+    async def refreshUser(self, service: Service, ident: int, name: str, pfp: str):
+        if not await self.store.updateDetails(service.name, ident, name, pfp):
+            return False
+        if self.cache is not None:
+            found, user = self.cache.get((service.name, ident))
+            if found and user is not None:
+                user.name = name
+                user.normalizedName = normalizeName(name)
+                user.pfp = pfp
+                await self.modified(user)
+                return True
+            self.cache.forget((service.name, ident))
+        await self.modified()
+        return True
+
+    async def addToGroup(self, user: User, group: str):
+        if not await self.store.addToGroup(user, group):
+            return False
+        if group not in user.groups:
+            user.groups.append(group)
+        await self.modified(user)
+        return True
+
+    async def removeFromGroup(self, user: User, group: str):
+        if not await self.store.removeFromGroup(user, group):
+            return False
+        while group in user.groups:
+            user.groups.remove(group)
+        await self.modified(user)
+        return True
+
+    async def linkUser(self, one: User, other: User):
+        one.linked[other.service] = other.id
+        other.linked[one.service] = one.id
+        await self.saveMany([one, other])
+
+    async def linkedUsers(self, users: list[User]):
+        # Maps the id of each of the given users to their accounts on other
+        # services, fetching every link that isn't cached in one query
+        graph: dict[ObjectId, dict[str, User]] = {}
+        unresolved: list[User] = []
+        for user in users:
+            if self.cache is not None:
+                if (linked := self.cache.getQuery(("linked", user.id))) is not None:
+                    graph[user.id] = {i.service: i for i in linked}
+                    continue
+            unresolved.append(user)
+        found: dict[ObjectId, User] = {}
+        if len(ids := {i for user in unresolved for i in user.linked.values()}):
+            found = {i.id: i for i in await self.store.findByIds(list(ids))}
+        for user in unresolved:
+            linked = [found[i] for i in user.linked.values() if i in found]
+            graph[user.id] = {i.service: i for i in linked}
+            if self.cache is not None:
+                self.cache.putQuery(("linked", user.id), linked)
+        return graph
+
+    async def memberIdentsOfGroup(self, service: Service, group: str):
+        # Yields (serviceIdent, name) pairs, for callers that don't need whole users
+        async for ident, name in self.store.identsInGroup(service.name, group):
+            yield ident, name
+
+    async def modified(self, *users: User):
+        if self.cache is not None:
+            for user in users:
+                self.cache.put((user.service, user.serviceIdent), user)
+        await self.userModify.send_async(self)
+
+    async def save(self, user: User):
+        await self.saveMany([user])
+
+    async def saveMany(self, users: list[User]):
+        if not len(users):
+            return
+        for user in users:
+            user.normalizedName = normalizeName(user.name)
+        await self.store.replace(users)
+        await self.modified(*users)
@@ -0,0 +1,190 @@
+from typing import Optional
+
+import logging
+import re
+
+from odmantic import AIOEngine, ObjectId
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from vyxalbot2.userdb import User, UserStore, normalizeName
+
+# Every shape of query we make against the users collection, and the index that serves it
+INDEXES = {
+    "service_serviceIdent": (
+        [("service", ASCENDING), ("serviceIdent", ASCENDING)],
+        True,
+    ),
+    "service_normalizedName": (
+        [("service", ASCENDING), ("normalizedName", ASCENDING)],
+        False,
+    ),
+    "service_groups": ([("service", ASCENDING), ("groups", ASCENDING)], False),
+}
+QUERY_SHAPES = [
+    {"service": "", "serviceIdent": 0},
+    {"service": "", "normalizedName": ""},
+    {"service": "", "normalizedName": {"$regex": "^a"}},
+    {"service": "", "groups": ""},
+]
+
+
+def usesIndex(plan: dict) -> bool:
+    if plan.get("stage") == "COLLSCAN":
+        return False
+    if "inputStage" in plan:
+        return usesIndex(plan["inputStage"])
+    if "inputStages" in plan:
+        return all(usesIndex(i) for i in plan["inputStages"])
+    return True
+
+
+class MongoUserStore(UserStore):
+    def __init__(self, client, database: str):
+        self.logger = logging.getLogger("MongoUserStore")
+        self.client = client
+        self.engine = AIOEngine(client=client, database=database)
+        self.collection = self.engine.get_collection(User)
+
+    async def setup(self):
+        # Users saved before normalizedName existed need it filled in
+        updates = [
+            UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {"normalizedName": normalizeName(document["name"])}},
+            )
+            async for document in self.collection.find(
+                {"normalizedName": {"$exists": False}}, {"name": 1}
+            )
+        ]
+        if len(updates):
+            await self.collection.bulk_write(updates)
+        for name, (keys, unique) in INDEXES.items():
+            await self.createIndex(name, keys, unique)
+        for shape in QUERY_SHAPES:
+            explanation = await self.collection.find(shape).explain()
+            if not usesIndex(explanation["queryPlanner"]["winningPlan"]):
+                self.logger.warning(
+                    f"Query on {', '.join(shape)} is not using an index!"
+                )
+
+    async def createIndex(self, name: str, keys: list, unique: bool):
+        # create_index does nothing if an identical index already exists
+        existing = (await self.collection.index_information()).get(name)
+        if existing is not None and existing.get("unique", False) != unique:
+            # Left non-unique by an earlier startup that found duplicates
+            await self.collection.drop_index(name)
+        try:
+            await self.collection.create_index(keys, name=name, unique=unique)
+        except OperationFailure:
+            if not unique:
+                raise
+            # Refusing to start would take the bot down over a few bad
+            # documents, so index them anyway and say what needs cleaning up
+            duplicates = [
+                "/".join(str(i) for i in document["_id"].values())
+                async for document in self.collection.aggregate(
+                    [
+                        {
+                            "$group": {
+                                "_id": {f: f"${f}" for f, _ in keys},
+                                "count": {"$sum": 1},
+                            }
+                        },
+                        {"$match": {"count": {"$gt": 1}}},
+                    ]
+                )
+            ]
+            self.logger.error(
+                f"Can't make {name} unique, because these users are duplicated: "
+                f"{', '.join(duplicates)}. Creating it as a non-unique index instead."
+            )
+            await self.collection.create_index(keys, name=name)
+
+    async def close(self):
+        self.client.close()
+
+    async def find(self, service: str, ident: int) -> Optional[User]:
+        return await self.engine.find_one(
+            User, User.service == service, User.serviceIdent == ident
+        )
+
+    async def findByName(self, service: str, normalizedName: str):
+        return await self.engine.find(
+            User, User.service == service, User.normalizedName == normalizedName
+        )
+
+    async def findByNamePrefix(self, service: str, prefix: str, limit: int):
+        # An anchored, case-sensitive regex is answered from the index
+        return await self.engine.find(
+            User,
+            User.service == service,
+            {"normalizedName": {"$regex": f"^{re.escape(prefix)}"}},
+            sort=User.normalizedName,
+            limit=limit,
+        )
+
+    async def findByIds(self, ids: list[ObjectId]):
+        return await self.engine.find(User, {"_id": {"$in": ids}})
+
+    async def identsInGroup(self, service: str, group: str):
+        # Only project the fields we need, rather than building a whole User each
+        async for document in self.collection.find(
+            {"service": service, "groups": group},
+            {"_id": 0, "serviceIdent": 1, "name": 1},
+        ):
+            yield document["serviceIdent"], document["name"]
+
+    async def sampleName(self, service: str) -> Optional[str]:
+        async for document in self.collection.aggregate(
+            [
+                {"$match": {"service": service}},
+                {"$sample": {"size": 1}},
+                {"$project": {"_id": 0, "name": 1}},
+            ]
+        ):
+            return document["name"]
+        return None
+
+    async def insert(self, user: User):
+        # A single upsert keyed on the unique index either creates the user or
+        # finds they already exist, with no window for a duplicate in between
+        try:
+            result = await self.collection.update_one(
+                {"service": user.service, "serviceIdent": user.serviceIdent},
+                {"$setOnInsert": user.doc()},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return result.upserted_id is not None
+
+    async def updateDetails(self, service: str, ident: int, name: str, pfp: str):
+        result = await self.collection.update_one(
+            {"service": service, "serviceIdent": ident},
+            {
+                "$set": {
+                    "name": name,
+                    "normalizedName": normalizeName(name),
+                    "pfp": pfp,
+                }
+            },
+        )
+        return bool(result.matched_count)
+
+    async def addToGroup(self, user: User, group: str):
+        result = await self.collection.update_one(
+            {"_id": user.id}, {"$addToSet": {"groups": group}}
+        )
+        return bool(result.modified_count)
+
+    async def removeFromGroup(self, user: User, group: str):
+        result = await self.collection.update_one(
+            {"_id": user.id}, {"$pull": {"groups": group}}
+        )
+        return bool(result.modified_count)
+
+    async def replace(self, users: list[User]):
+        await self.collection.bulk_write(
+            [ReplaceOne({"_id": user.id}, user.doc(), upsert=True) for user in users]
+        )
@@ -0,0 +1,226 @@
+from typing import Optional
+
+import json
+import sqlite3
+
+from odmantic import ObjectId
+
+from vyxalbot2.userdb import User, UserStore, normalizeName
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    serviceIdent INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    pfp TEXT NOT NULL,
+    linked TEXT NOT NULL DEFAULT '{}',
+    bonusData TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (service, serviceIdent)
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    userId TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    service TEXT NOT NULL,
+    groupName TEXT NOT NULL,
+    PRIMARY KEY (userId, groupName)
+);
+CREATE INDEX IF NOT EXISTS memberships_service_groupName ON memberships (service, groupName);
+"""
+# Added after the users table was, so older databases need it added
+NORMALIZED_NAME = """
+ALTER TABLE users ADD COLUMN normalizedName TEXT NOT NULL DEFAULT '';
+UPDATE users SET normalizedName = normalizeName(name);
+"""
+NORMALIZED_NAME_INDEX = """
+DROP INDEX IF EXISTS users_service_name;
+CREATE INDEX IF NOT EXISTS users_service_normalizedName
+ON users (service, normalizedName);
+"""
+# Groups are kept in the order they were added, like the array Mongo stores them in
+USER_COLUMNS = """
+    users.id, users.service, users.serviceIdent, users.name, users.pfp,
+    users.linked, users.bonusData, users.normalizedName,
+    (
+        SELECT json_group_array(groupName) FROM (
+            SELECT groupName FROM memberships
+            WHERE memberships.userId = users.id ORDER BY memberships.rowid
+        )
+    )
+"""
+
+# What to do when a user being written is already there
+INSERT_USER = "ON CONFLICT DO NOTHING"
+REPLACE_USER = """ON CONFLICT (id) DO UPDATE SET
+    service = excluded.service, serviceIdent = excluded.serviceIdent,
+    name = excluded.name, pfp = excluded.pfp,
+    linked = excluded.linked, bonusData = excluded.bonusData,
+    normalizedName = excluded.normalizedName"""
+
+
+def toUser(row: tuple) -> User:
+    (
+        ident,
+        service,
+        serviceIdent,
+        name,
+        pfp,
+        linked,
+        bonusData,
+        normalizedName,
+        groups,
+    ) = row
+    return User(
+        id=ObjectId(ident),
+        service=service,
+        serviceIdent=serviceIdent,
+        name=name,
+        normalizedName=normalizedName,
+        pfp=pfp,
+        groups=json.loads(groups),
+        linked={
+            service: ObjectId(other) for service, other in json.loads(linked).items()
+        },
+        bonusData=json.loads(bonusData),
+    )
+
+
+class SQLiteUserStore(UserStore):
+    # Keeps users in a local SQLite database instead of a Mongo server. Every
+    # query is a primary key or index lookup on a file on the same machine, so
+    # they're run directly on the event loop rather than in a thread.
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+
+    async def setup(self):
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.create_function("normalizeName", 1, normalizeName, deterministic=True)
+        with self.db:
+            self.db.executescript(SCHEMA)
+            columns = [i[1] for i in self.db.execute("PRAGMA table_info(users)")]
+            if "normalizedName" not in columns:
+                self.db.executescript(NORMALIZED_NAME)
+            self.db.executescript(NORMALIZED_NAME_INDEX)
+
+    async def close(self):
+        self.db.close()
+
+    def findOne(self, where: str, *args) -> Optional[User]:
+        row = self.db.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE {where}", args
+        ).fetchone()
+        return None if row is None else toUser(row)
+
+    async def find(self, service: str, ident: int):
+        return self.findOne("service = ? AND serviceIdent = ?", service, ident)
+
+    async def findByName(self, service: str, normalizedName: str):
+        return [
+            toUser(row)
+            for row in self.db.execute(
+                f"""SELECT {USER_COLUMNS} FROM users
+                WHERE service = ? AND normalizedName = ?""",
+                (service, normalizedName),
+            )
+        ]
+
+    async def findByNamePrefix(self, service: str, prefix: str, limit: int):
+        # Written as a range so that it's answered from the index; no string
+        # can sort after the prefix followed by the highest code point
+        return [
+            toUser(row)
+            for row in self.db.execute(
+                f"""SELECT {USER_COLUMNS} FROM users
+                WHERE service = ? AND normalizedName >= ? AND normalizedName < ?
+                ORDER BY normalizedName LIMIT ?""",
+                (service, prefix, prefix + chr(0x10FFFF), limit),
+            )
+        ]
+
+    async def findByIds(self, ids: list[ObjectId]):
+        # Passing the ids as one JSON array avoids SQLite's limit on parameters
+        return [
+            toUser(row)
+            for row in self.db.execute(
+                f"""SELECT {USER_COLUMNS} FROM users
+                WHERE id IN (SELECT value FROM json_each(?))""",
+                (json.dumps([str(i) for i in ids]),),
+            )
+        ]
+
+    async def identsInGroup(self, service: str, group: str):
+        for ident, name in self.db.execute(
+            """SELECT users.serviceIdent, users.name FROM memberships
+            JOIN users ON users.id = memberships.userId
+            WHERE memberships.service = ? AND memberships.groupName = ?""",
+            (service, group),
+        ):
+            yield ident, name
+
+    async def sampleName(self, service: str) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT name FROM users WHERE service = ? ORDER BY random() LIMIT 1",
+            (service,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def write(self, user: User, upsert: str):
+        cursor = self.db.execute(
+            f"INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?) {upsert}",
+            (
+                str(user.id),
+                user.service,
+                user.serviceIdent,
+                user.name,
+                user.pfp,
+                json.dumps(
+                    {service: str(other) for service, other in user.linked.items()}
+                ),
+                json.dumps(user.bonusData),
+                user.normalizedName,
+            ),
+        )
+        if not cursor.rowcount:
+            return False
+        self.db.execute("DELETE FROM memberships WHERE userId = ?", (str(user.id),))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO memberships VALUES (?, ?, ?)",
+            [(str(user.id), user.service, group) for group in user.groups],
+        )
+        return True
+
+    async def insert(self, user: User):
+        with self.db:
+            return self.write(user, INSERT_USER)
+
+    async def updateDetails(self, service: str, ident: int, name: str, pfp: str):
+        with self.db:
+            cursor = self.db.execute(
+                """UPDATE users SET name = ?, normalizedName = ?, pfp = ?
+                WHERE service = ? AND serviceIdent = ?""",
+                (name, normalizeName(name), pfp, service, ident),
+            )
+        return bool(cursor.rowcount)
+
+    async def addToGroup(self, user: User, group: str):
+        with self.db:
+            cursor = self.db.execute(
+                """INSERT OR IGNORE INTO memberships
+                SELECT id, service, ? FROM users WHERE id = ?""",
+                (group, str(user.id)),
+            )
+        return bool(cursor.rowcount)
+
+    async def removeFromGroup(self, user: User, group: str):
+        with self.db:
+            cursor = self.db.execute(
+                "DELETE FROM memberships WHERE userId = ? AND groupName = ?",
+                (str(user.id), group),
+            )
+        return bool(cursor.rowcount)
+
+    async def replace(self, users: list[User]):
+        with self.db:
+            for user in users:
+                self.write(user, REPLACE_USER)
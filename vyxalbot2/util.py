@@ -28,6 +28,13 @@ def resolveChatPFP(pfp: str):
     return f"https://www.gravatar.com/avatar/{pfp}?s=256&d=identicon&r=PG"
 
 
+def knownPFP(pfp: str):
+    async def resolve():
+        return pfp
+
+    return resolve
+
+
 def extractMessageIdent(ident: str):
     if ident.isdigit():
         return int(ident)